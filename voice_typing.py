@@ -24,7 +24,7 @@ CONTROLES:
 REQUISITOS:
     - Micrófono USB SF-558 conectado
     - Modelo Vosk: ~/.openclaw/workspace/vosk-model/vosk-model-small-es-0.42/
-    - Python 3.x con: vosk, pyaudio, pyautogui, audioop
+    - Python 3.x con: vosk, pyaudio, pyautogui, numpy
 
 HARDWARE:
     - Mini PC: MINISFORUM AI X1 Pro
@@ -49,13 +49,28 @@ except:
     pass
 
 import tkinter as tk
-import pyautogui
 import threading
 import queue
 import json
 import sys
 import os
-import audioop
+import re
+import subprocess
+import importlib
+import urllib.parse
+import shutil
+import math
+import time
+STARTUP_T0 = time.perf_counter()  # Referencia para --startup-profile
+import argparse
+import wave
+import glob
+import socket
+import signal
+import unicodedata
+import multiprocessing
+from collections import deque
+import numpy as np
 
 # Añadir path del modelo y configuración
 MODEL_PATH = os.path.expanduser("~/.openclaw/workspace/vosk-model/vosk-model-small-es-0.42")
@@ -66,50 +81,3312 @@ DEFAULT_CONFIG = {
     "energy_threshold": 150,     # Sensibilidad del micrófono
     "volume_boost": 1.0,         # Boost de volumen (1.0 = sin boost)
     "pause_threshold": 0.5,      # Tiempo de pausa entre frases
+    # Fuente de audio: "pyaudio" (micrófono), "file:RUTA" (WAV/PCM),
+    # "stdin" (PCM por la entrada estándar) o "unix:RUTA" (socket)
+    "audio_source": "pyaudio",
+    "audio_source_rate": 16000,  # Frecuencia del PCM crudo (stdin, socket, .raw)
+    "audio_device": None,        # Último micrófono que funcionó (se guarda solo)
+    "audio_retry_max_s": 10,     # Espera máxima entre reintentos si se cae el micro
+    # Con "audio_source": "multi": fuentes a capturar a la vez. Un nombre
+    # suelto es parte del nombre de un micrófono ("usb" = "pyaudio:usb")
+    "audio_devices": [],
+    "audio_mix": "best",         # best (el de mejor SNR en cada bloque) | mix
+    "capture_profile": "balanced",  # low-latency | balanced | throughput
+    "capture_chunk_ms": None,    # Tamaño de bloque en ms (None = el del perfil)
+    # Acondicionamiento de señal (a 16kHz, antes del VAD y de Vosk)
+    "agc_enabled": True,         # Ganancia automática (volume_boost = ajuste fino)
+    "agc_target_dbfs": -20,      # Nivel de voz objetivo
+    "agc_max_gain_db": 20,       # Ganancia máxima (no subir el ruido sin límite)
+    "noise_calibration_s": 2.0,  # Primeros segundos para medir el ruido de fondo
+    "spectral_gate": False,      # Quitar ruido estacionario (ventiladores) por FFT
+    "vad_enabled": True,         # No mandar silencio al reconocedor
+    "vad_hangover_ms": 400,      # Cola de audio tras dejar de hablar
+    "vad_preroll_ms": 300,       # Audio previo a la voz (no cortar sílabas)
+    "queue_max_seconds": 2.0,    # Retraso máximo de audio pendiente de reconocer
+    "queue_policy": "drop-oldest",  # drop-oldest | drop-silence-first | block
     "enter_words": ["intro", "enter", "salto", "enviar"],
+    # Correcciones palabra -> reemplazo (solo palabras completas, sin
+    # distinguir mayúsculas). Editable a mano; se recarga sin reiniciar.
+    "corrections": {
+        # Caracteres especiales en español
+        "senor": "señor",
+        "ano": "año",
+        "manana": "mañana",
+        "corazon": "corazón",
+        "cancion": "canción",
+        "nacion": "nación",
+        "accion": "acción",
+        # Variantes de "Bichin" (mi nombre - sin acento para evitar problemas de codificacion)
+        "bitcoin": "Bichin",
+        "virgin": "Bichin",
+        "bichn": "Bichin",
+        "bici": "Bichin",
+        "jim": "Bichin",
+        "beach in": "Bichin",
+        "begin": "Bichin",
+        "pitching": "Bichin",
+        "beachin": "Bichin",
+        "bichin": "Bichin",
+        "biching": "Bichin",
+        "mi-jin": "Bichin",
+        "mijin": "Bichin",
+        "mijing": "Bichin",
+        "beechin": "Bichin",
+        "bechin": "Bichin"
+    },
+    # Comandos de voz propios. Cada uno: "say" (frases exactas) o "prefix"
+    # (frase + argumento {query}) y una acción: "run", "open" o "keys".
+    #   {"say": ["abre gimp"], "run": ["gimp"]}
+    #   {"prefix": ["wiki"], "open": "https://es.wikipedia.org/wiki/{query}"}
+    #   {"say": ["guarda"], "keys": ["ctrl", "s"]}
+    "commands": [],
+    "command_plugins": [],       # Módulos Python con register(registry)
+    # Modo comando: tras decir una de estas palabras (o con la señal
+    # SIGUSR1 / click central), la siguiente frase se reconoce con una
+    # gramática cerrada hecha con la tabla de comandos
+    "command_words": ["comando", "orden"],
+    "command_timeout_s": 5,      # Vuelve a dictado si no se dice nada
+    # Salida de texto: auto | xdotool | ydotool | uinput | pyautogui | null
+    "output_sink": "auto",
+    "output_chunk_chars": 200,   # Máximo de caracteres por orden de escritura
+    "output_clipboard_min_chars": 120,  # Texto más largo se pega (0 = nunca)
+    "output_key_delay_ms": 0,    # Pausa entre teclas (algunas apps la necesitan)
+    "streaming_typing": False,   # Escribir mientras hablas (con parciales estables)
+    "streaming_stable_partials": 3,  # Parciales seguidos en que una palabra no cambia
+    # Métricas de latencia: "prometheus" (textfile para node_exporter),
+    # "jsonl" o None para no exportar
+    "metrics_format": None,
+    "metrics_path": "~/.openclaw/workspace/voice_typing.prom",
+    "metrics_interval_s": 10,
+    "startup_buffer_seconds": 30,  # Audio guardado mientras carga el modelo
+    # Servidor de transcripción compartido ("unix:RUTA" o "tcp:HOST:PUERTO");
+    # None = cargar el modelo en este proceso
+    "recognizer_server": None,
+    "recognizer_timeout_s": 10.0,  # Espera máxima por respuesta del servidor
+    # Diario de lo dictado (solo se añade, en segmentos con índice para buscar)
+    "journal_enabled": True,
+    "journal_dir": "~/.openclaw/workspace/voice_journal",
+    "journal_segment_mb": 16,    # Tamaño de cada segmento antes de rotar
+    "journal_fsync_s": 2.0,      # Cada cuánto se fuerza a disco (por tandas)
+    # Segunda pasada: cada frase se vuelve a reconocer con un modelo grande
+    # en otro proceso (p.ej. ".../vosk-model-es-0.42"); None = desactivada
+    "second_pass_model": None,
+    "second_pass_action": "patch",  # patch: corregir lo escrito | journal: solo el diario
+    "second_pass_window_s": 15,  # Solo se corrige la última frase y si es reciente
+    "second_pass_workers": 1,    # Procesos con el modelo grande (con nice)
     "auto_save": True            # Guardar cambios automáticamente
 }
 
+# Tamaño de bloque de captura (ms) por perfil: bloques pequeños = menos
+# retraso, bloques grandes = menos llamadas (menos CPU) por segundo
+CAPTURE_PROFILES = {
+    "low-latency": 20,
+    "balanced": 90,
+    "throughput": 250,
+}
+
 # === CARGAR CONFIGURACIÓN DEL USUARIO ===
 def load_config():
     """Carga configuración guardada o usa defaults"""
     if os.path.exists(CONFIG_PATH):
         try:
-            with open(CONFIG_PATH, 'r') as f:
-                user_config = json.load(f)
-                # Merge con defaults (por si faltan campos nuevos)
-                config = DEFAULT_CONFIG.copy()
-                config.update(user_config)
-                print(f"⚙️ Configuración cargada: {CONFIG_PATH}")
-                return config
+            with open(CONFIG_PATH, 'r') as f:
+                user_config = json.load(f)
+                # Merge con defaults (por si faltan campos nuevos)
+                config = DEFAULT_CONFIG.copy()
+                config.update(user_config)
+                print(f"⚙️ Configuración cargada: {CONFIG_PATH}")
+                return config
+        except Exception as e:
+            print(f"⚠️ Error cargando config: {e}, usando defaults")
+    return DEFAULT_CONFIG.copy()
+
+def save_config_value(key, value):
+    """Guarda un solo valor en la config del usuario (sin tocar el resto)"""
+    user_config = {}
+    if os.path.exists(CONFIG_PATH):
+        try:
+            with open(CONFIG_PATH, 'r') as f:
+                user_config = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Error leyendo config: {e}")
+            return False
+    user_config[key] = value
+    try:
+        with open(CONFIG_PATH, 'w') as f:
+            json.dump(user_config, f, indent=2)
+        return True
+    except Exception as e:
+        print(f"⚠️ Error guardando config: {e}")
+        return False
+
+def save_config(config):
+    """Guarda configuración del usuario"""
+    try:
+        with open(CONFIG_PATH, 'w') as f:
+            json.dump(config, f, indent=2)
+        print(f"💾 Configuración guardada: {CONFIG_PATH}")
+        return True
+    except Exception as e:
+        print(f"⚠️ Error guardando config: {e}")
+        return False
+
+# Marcadores en la cola de audio (ningún bloque int16 mide 0 o 1 bytes)
+SPEECH_END = b''       # La puerta VAD se ha cerrado (fin de voz)
+COMMAND_MODE = b'\0'   # Atajo de modo comando: cerrar la frase y cambiar
+QUEUE_MARKERS = (SPEECH_END, COMMAND_MODE)
+
+
+def pcm_rms(samples):
+    """RMS de un bloque int16 (misma escala que audioop.rms)"""
+    if not len(samples):
+        return 0
+    x = samples.astype(np.float32)
+    return int(math.sqrt(float(np.dot(x, x)) / len(x)))
+
+
+class Resampler:
+    """Conversor de frecuencia con estado entre bloques
+
+    Filtro paso bajo FIR (sinc con ventana) para evitar aliasing e
+    interpolación lineal. El historial del filtro y la fase fraccionaria
+    se conservan entre bloques, así no hay saltos en cada frontera.
+    Todos los buffers se reservan una vez (y al cambiar de tamaño de
+    bloque): la salida es un buffer interno que vale hasta el siguiente
+    process().
+    """
+
+    def __init__(self, input_rate, output_rate, taps=31):
+        self.step = input_rate / output_rate
+        # Corte un poco por debajo de Nyquist de la frecuencia más baja
+        cutoff = 0.45 * min(1.0, output_rate / input_rate)
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+        # El kernel es simétrico: da igual convolución que correlación
+        self.kernel = (kernel / kernel.sum()).astype(np.float32)
+        self.keep = taps - 1
+        self.buf = np.zeros(self.keep, dtype=np.float32)  # [historial | bloque]
+        self.size = None
+        self.pos = 1.0  # Posición del siguiente sample de salida
+
+    def allocate(self, n):
+        """Buffers de trabajo para bloques de n muestras"""
+        keep = self.keep
+        # El historial va al final, donde process() espera el del bloque anterior
+        buf = np.zeros(keep + n, dtype=np.float32)
+        buf[n:] = self.buf[len(self.buf) - keep:]
+        last = self.z[len(self.z) - 1] if self.size else 0.0
+        self.buf = buf
+        # z[0] es el último sample filtrado del bloque anterior, z[i] = y[i-1]
+        self.z = np.zeros(n + 1, dtype=np.float32)
+        self.z[n] = last
+        self.tmp = np.empty(n, dtype=np.float32)
+        count = int(n / self.step) + 2  # Máximo de muestras de salida
+        self.offsets = np.arange(count) * self.step
+        self.t = np.empty(count)
+        self.floor = np.empty(count)
+        self.idx = np.empty(count, dtype=np.int64)
+        self.frac = np.empty(count, dtype=np.float32)
+        self.a = np.empty(count, dtype=np.float32)
+        self.b = np.empty(count, dtype=np.float32)
+        self.size = n
+
+    def process(self, x):
+        """Convierte un bloque (int16 o float32) y devuelve float32"""
+        n = len(x)
+        if n != self.size:
+            self.allocate(n)
+        keep, buf, z, tmp = self.keep, self.buf, self.z, self.tmp
+        buf[:keep] = buf[n:]
+        buf[keep:] = x  # Conversión a float32 sin array intermedio
+        z[0] = z[n]
+        
+        # FIR tap a tap sobre vistas: sin arrays nuevos (y más rápido que
+        # np.convolve en float32)
+        y = z[1:]
+        np.multiply(buf[:n], self.kernel[0], out=y)
+        for k in range(1, len(self.kernel)):
+            np.multiply(buf[k:k + n], self.kernel[k], out=tmp)
+            np.add(y, tmp, out=y)
+        
+        # Interpolación lineal en t = pos, pos + step, ... (< n)
+        count = max(0, math.ceil((n - self.pos) / self.step))
+        t, floor, idx = self.t[:count], self.floor[:count], self.idx[:count]
+        frac, a, b = self.frac[:count], self.a[:count], self.b[:count]
+        # Mezclar tipos en un ufunc con out= crea buffers: todo en float64
+        # y las conversiones con copyto
+        np.add(self.offsets[:count], self.pos, out=t)
+        np.floor(t, out=floor)
+        np.copyto(idx, floor, casting='unsafe')
+        np.subtract(t, floor, out=floor)
+        np.copyto(frac, floor, casting='same_kind')
+        # mode='clip' (los índices ya están en rango): 'raise' usa un buffer
+        np.take(z, idx, out=a, mode='clip')
+        idx += 1
+        np.take(z, idx, out=b, mode='clip')
+        b -= a
+        b *= frac
+        a += b
+        if count:
+            self.pos = t[count - 1] + self.step - n
+        else:
+            self.pos -= n
+        return a
+
+
+class AudioPipeline:
+    """Ganancia y conversión a 16kHz vectorizadas sobre bloques int16
+
+    Con conditioner, la ganancia fija la sustituye el acondicionamiento
+    (AGC, limitador y puerta de ruido), aplicado ya a 16kHz. Los buffers
+    intermedios y el de salida se reservan una vez: el array devuelto
+    vale hasta el siguiente process().
+    """
+
+    def __init__(self, input_rate, target_rate, conditioner=None):
+        self.input_rate = input_rate
+        self.target_rate = target_rate
+        self.conditioner = conditioner
+        self.level = 0  # RMS del último bloque antes del AGC (x ganancia)
+        self.resampler = None
+        if input_rate != target_rate:
+            self.resampler = Resampler(input_rate, target_rate)
+        self.work = np.empty(0, dtype=np.float32)  # Bloque en float sin conversor
+        self.out = np.empty(0, dtype=np.int16)
+
+    def reset(self):
+        """Reinicia el estado del conversor (audio discontinuo)"""
+        if self.resampler is not None:
+            self.resampler = Resampler(self.input_rate, self.target_rate)
+        if self.conditioner is not None:
+            self.conditioner.reset()
+
+    def process(self, data, gain=1.0):
+        """bytes int16 a la frecuencia del micro -> array int16 a 16kHz"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        if gain == 1.0 and self.resampler is None and self.conditioner is None:
+            return samples
+        # El conversor lee int16 directamente (la ganancia es lineal: da
+        # igual aplicarla antes o después)
+        if self.resampler is not None:
+            x = self.resampler.process(samples)
+        else:
+            if len(self.work) != len(samples):
+                self.work = np.empty(len(samples), dtype=np.float32)
+            x = self.work
+            np.copyto(x, samples)
+        if self.conditioner is not None:
+            # El limitador ya deja todo en rango
+            x = self.conditioner.process(x, gain)
+            self.level = int(self.conditioner.level * gain)
+        else:
+            if gain != 1.0:
+                x *= gain
+            np.clip(x, -32768, 32767, out=x)
+        if len(self.out) != len(x):
+            self.out = np.empty(len(x), dtype=np.int16)
+        np.copyto(self.out, x, casting='unsafe')
+        return self.out
+
+
+def soft_limit(x, knee=16384.0, ceiling=32767.0):
+    """Limitador suave: lineal hasta knee, curva tanh hasta ceiling (sin recortes)"""
+    # Lo normal es no pasar de knee: comprobarlo sin crear arrays
+    if not len(x) or (x.max() <= knee and x.min() >= -knee):
+        return x
+    over = np.abs(x) > knee
+    span = ceiling - knee
+    limited = np.sign(x) * (knee + span * np.tanh((np.abs(x) - knee) / span))
+    return np.where(over, limited, x).astype(np.float32)
+
+
+class SpectralGate:
+    """Resta el espectro del ruido estacionario (STFT con solape del 50%)
+
+    Ventanas de 32ms y paso de 16ms a 16kHz con raíz de Hann en análisis
+    y síntesis, así la suma con solape reconstruye la señal. Añade un paso
+    (16ms) de retraso. El espectro del ruido se aprende solo en silencio.
+    """
+
+    def __init__(self, frame=512, strength=1.5, floor=0.1):
+        self.frame = frame
+        self.hop = frame // 2
+        self.window = np.sqrt(np.hanning(frame + 1)[:-1]).astype(np.float32)
+        self.strength = strength  # Cuánto ruido restar (1 = la media medida)
+        self.floor = floor        # Atenuación máxima por banda (-20dB)
+        self.reset()
+
+    def reset(self):
+        self.pending = np.zeros(self.frame - self.hop, dtype=np.float32)
+        self.tail = np.zeros(self.hop, dtype=np.float32)
+        self.noise = None  # Magnitud media del ruido por banda
+
+    def process(self, x, learn):
+        """Bloque float32 -> bloque filtrado (múltiplo de hop, con retraso fijo)"""
+        data = np.concatenate((self.pending, x))
+        count = (len(data) - self.frame) // self.hop + 1
+        if count <= 0:
+            self.pending = data
+            return np.zeros(0, dtype=np.float32)
+        idx = np.arange(self.frame)[None, :] + self.hop * np.arange(count)[:, None]
+        spectrum = np.fft.rfft(data[idx] * self.window, axis=1)
+        magnitude = np.abs(spectrum)
+        if learn:
+            frame_noise = magnitude.mean(axis=0)
+            self.noise = frame_noise if self.noise is None else 0.9 * self.noise + 0.1 * frame_noise
+        if self.noise is not None:
+            mask = 1.0 - self.strength * self.noise / (magnitude + 1e-3)
+            spectrum *= np.clip(mask, self.floor, 1.0)
+        frames = np.fft.irfft(spectrum, n=self.frame, axis=1).astype(np.float32) * self.window
+        
+        # Suma con solape: cada trama aporta su primera mitad a un paso y la
+        # segunda al siguiente
+        out = np.zeros((count + 1) * self.hop, dtype=np.float32)
+        out[:self.hop] += self.tail
+        halves = out.reshape(-1, self.hop)
+        halves[:-1] += frames[:, :self.hop]
+        halves[1:] += frames[:, self.hop:]
+        self.tail = out[count * self.hop:].copy()
+        self.pending = data[count * self.hop:]
+        return out[:count * self.hop]
+
+
+class SignalConditioner:
+    """AGC con limitador suave, ruido de fondo calibrado y puerta espectral
+
+    El ruido de fondo se mide en los primeros segundos y luego solo en
+    bloques de silencio. La ganancia solo se adapta cuando hay voz (10dB
+    por encima del ruido), así en silencio no sube el ventilador; sube
+    despacio y baja rápido. Todo va por bloques con NumPy.
+    """
+
+    SPEECH_RATIO = 3.16  # 10dB sobre el ruido = voz
+
+    def __init__(self, rate=16000, agc=True, target_dbfs=-20, max_gain_db=20,
+                 calibration_s=2.0, spectral_gate=False):
+        self.rate = rate
+        self.agc = agc
+        self.target = 32768 * 10 ** (target_dbfs / 20)
+        self.max_gain = 10 ** (max_gain_db / 20)
+        self.calibration_samples = int(calibration_s * rate)
+        self.gate = SpectralGate() if spectral_gate else None
+        self.out = np.empty(0, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        """Vuelve a calibrar (otro micro, otra sala)"""
+        self.gain = 1.0
+        self.level = 0
+        self.noise_floor = None
+        self.calibration = []  # RMS de los bloques de calibración
+        self.seen = 0
+        if self.gate is not None:
+            self.gate.reset()
+
+    @property
+    def calibrating(self):
+        return self.seen < self.calibration_samples
+
+    def update_noise(self, rms, n):
+        """Ruido de fondo: percentil bajo al calibrar, luego solo en silencio"""
+        self.seen += n
+        if self.calibrating or self.noise_floor is None:
+            self.calibration.append(rms)
+            self.noise_floor = max(float(np.percentile(self.calibration, 20)), 1.0)
+            if not self.calibrating:
+                self.calibration = []
+            return True
+        if rms < 2 * self.noise_floor:
+            self.noise_floor += 0.05 * (rms - self.noise_floor)
+            self.noise_floor = max(self.noise_floor, 1.0)
+            return True
+        return False
+
+    def buffers(self, n):
+        """Salida y rampa de ganancia preasignadas para bloques de n muestras"""
+        if len(self.out) != n:
+            self.out = np.empty(n, dtype=np.float32)
+            self.ramp = np.empty(n, dtype=np.float32)
+            # Pasos de la rampa de ganancia: 0 ... 1 (como np.linspace)
+            self.steps = np.linspace(0.0, 1.0, n, dtype=np.float32)
+        return self.out, self.ramp
+
+    def process(self, x, gain=1.0):
+        """Bloque float32 (escala int16) -> bloque acondicionado y limitado
+
+        No modifica x. El resultado puede ser un buffer interno: vale hasta
+        el siguiente process().
+        """
+        n = len(x)
+        if not n:
+            return x
+        rms = math.sqrt(float(np.dot(x, x)) / n)
+        self.level = rms
+        silent = self.update_noise(rms, n)
+        
+        if self.gate is not None:
+            x = self.gate.process(x, learn=silent)
+            if not len(x):
+                return x
+        
+        if self.agc:
+            previous = self.gain
+            if rms > self.SPEECH_RATIO * self.noise_floor:
+                wanted = min(self.max_gain, max(0.1, self.target * gain / rms))
+                # Ataque ~50ms, relajación ~1s (constantes según el bloque)
+                tau = 0.05 if wanted < self.gain else 1.0
+                alpha = 1.0 - math.exp(-(n / self.rate) / tau)
+                self.gain += alpha * (wanted - self.gain)
+            out, ramp = self.buffers(len(x))
+            # Rampa dentro del bloque: sin escalones audibles
+            if previous != self.gain:
+                np.multiply(self.steps, np.float32(self.gain - previous), out=ramp)
+                ramp += np.float32(previous)
+                np.multiply(x, ramp, out=out)
+            else:
+                np.multiply(x, np.float32(self.gain), out=out)
+            x = out
+        elif gain != 1.0:
+            out, _ = self.buffers(len(x))
+            x = np.multiply(x, np.float32(gain), out=out)
+        return soft_limit(x)
+
+
+def create_conditioner(config, rate=16000):
+    """Acondicionamiento según la config (None si todo está desactivado)"""
+    agc = config.get('agc_enabled', True)
+    spectral_gate = config.get('spectral_gate', False)
+    if not agc and not spectral_gate:
+        return None
+    return SignalConditioner(
+        rate, agc=agc,
+        target_dbfs=config.get('agc_target_dbfs', -20),
+        max_gain_db=config.get('agc_max_gain_db', 20),
+        calibration_s=config.get('noise_calibration_s', 2.0),
+        spectral_gate=spectral_gate
+    )
+
+
+def benchmark_dsp(input_rate=44100, target_rate=16000, seconds=30, gain=1.5):
+    """Compara CPU por segundo de audio: audioop (ratecv sin estado) vs NumPy"""
+    chunk = 4096
+    rng = np.random.default_rng(0)
+    t = np.arange(input_rate * seconds) / input_rate
+    signal = 3000 * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 300, len(t))
+    pcm = np.clip(signal, -32768, 32767).astype(np.int16).tobytes()
+    chunks = [pcm[i:i + chunk * 2] for i in range(0, len(pcm), chunk * 2)]
+    
+    print(f"⏱️ DSP: {seconds}s de audio, {input_rate}Hz -> {target_rate}Hz, "
+          f"boost {gain}x, bloques de {chunk}")
+    try:
+        import audioop
+    except ImportError:
+        audioop = None
+        print("   audioop: no disponible en este Python (eliminado en 3.13)")
+    if audioop is not None:
+        start = time.process_time()
+        for data in chunks:
+            data = audioop.mul(data, 2, gain)
+            data, _ = audioop.ratecv(data, 2, 1, input_rate, target_rate, None)
+        cpu = time.process_time() - start
+        print(f"   audioop: {1000 * cpu / seconds:.3f} ms CPU por segundo de audio")
+    
+    pipeline = AudioPipeline(input_rate, target_rate)
+    start = time.process_time()
+    for data in chunks:
+        pipeline.process(data, gain).tobytes()
+    cpu = time.process_time() - start
+    print(f"   numpy:   {1000 * cpu / seconds:.3f} ms CPU por segundo de audio")
+
+
+def resolve_chunk_ms(config):
+    """Perfil de captura y tamaño de bloque (ms) según la config"""
+    profile = config.get('capture_profile', 'balanced')
+    if profile not in CAPTURE_PROFILES:
+        print(f"⚠️ Perfil de captura desconocido '{profile}', usando balanced")
+        profile = 'balanced'
+    return profile, config.get('capture_chunk_ms') or CAPTURE_PROFILES[profile]
+
+
+def chunk_frames_for(rate, chunk_ms):
+    """Frames de un bloque de chunk_ms a esta frecuencia (redondeado)"""
+    return max(1, int(round(rate * chunk_ms / 1000)))
+
+
+class VoiceGate:
+    """Puerta de actividad de voz por energía con hangover y pre-roll
+
+    Solo deja pasar los bloques con voz. Mientras hay silencio guarda los
+    últimos bloques en un buffer circular para que, al detectar voz, el
+    reconocedor reciba también el inicio de la primera sílaba.
+    """
+
+    def __init__(self, threshold, chunk_ms, hangover_ms=400, preroll_ms=300):
+        self.threshold = threshold
+        self.hangover_chunks = max(1, math.ceil(hangover_ms / chunk_ms))
+        self.preroll = deque(maxlen=max(1, math.ceil(preroll_ms / chunk_ms)))
+        self.hangover_left = 0
+        self.active = False
+        # Contadores para comprobar el ahorro
+        self.frames_passed = 0
+        self.frames_dropped = 0
+
+    def process(self, data, rms):
+        """Devuelve la lista de bloques a enviar al reconocedor
+
+        Al cerrarse la puerta se añade SPEECH_END para que el reconocedor
+        cierre la frase (ya no le llega el silencio que lo haría solo).
+        """
+        if rms >= self.threshold:
+            self.hangover_left = self.hangover_chunks
+            out = [data]
+            if not self.active:
+                self.active = True
+                out = list(self.preroll) + out
+                self.preroll.clear()
+        elif self.active and self.hangover_left > 0:
+            self.hangover_left -= 1
+            out = [data]
+        elif self.active:
+            # Fin de la voz: cerrar la puerta
+            self.active = False
+            self.preroll.append(data)
+            return [SPEECH_END]
+        else:
+            # Silencio: al pre-roll (si está lleno, el más antiguo se pierde)
+            if len(self.preroll) == self.preroll.maxlen:
+                self.frames_dropped += len(self.preroll[0]) // 2
+            self.preroll.append(data)
+            return []
+        self.frames_passed += sum(len(chunk) for chunk in out) // 2
+        return out
+
+    def reset(self):
+        """Olvida el estado (pre-roll y hangover), p.ej. al reanudar"""
+        self.active = False
+        self.hangover_left = 0
+        self.preroll.clear()
+
+    def stats(self):
+        """Resumen de bloques pasados vs descartados"""
+        total = self.frames_passed + self.frames_dropped
+        saved = 100.0 * self.frames_dropped / total if total else 0.0
+        return (f"VAD: {self.frames_passed} frames al reconocedor, "
+                f"{self.frames_dropped} descartados ({saved:.0f}% ahorro)")
+
+
+class FrameRing:
+    """Anillo preasignado de muestras int16, un productor y un consumidor
+
+    Sin candados: el productor solo mueve head y el consumidor solo tail
+    (contadores de muestras que solo crecen; con el GIL cada asignación
+    es atómica). Las primeras max_read muestras se copian también detrás
+    del final, así cualquier lectura de hasta max_read muestras es una
+    vista contigua, sin copiar. Si el anillo se llena, lo nuevo se pierde
+    (el productor no puede tocar tail).
+    """
+
+    def __init__(self, capacity, max_read):
+        self.capacity = max(capacity, max_read)
+        self.max_read = max_read
+        self.buf = np.zeros(self.capacity + max_read, dtype=np.int16)
+        self.head = 0  # Muestras escritas (solo el productor)
+        self.tail = 0  # Muestras liberadas (solo el consumidor)
+        self.data_ready = threading.Event()
+        self.dropped = 0
+
+    def available(self):
+        return self.head - self.tail
+
+    def write(self, samples):
+        """Productor: copia las muestras (int16) que quepan; devuelve cuántas"""
+        n = len(samples)
+        free = self.capacity - (self.head - self.tail)
+        if n > free:
+            self.dropped += n - free
+            n = free
+            if n <= 0:
+                return 0
+        pos = self.head % self.capacity
+        if pos >= self.max_read and pos + n <= self.capacity:
+            # Caso normal: un solo trozo, lejos del espejo
+            self.buf[pos:pos + n] = samples[:n]
+            self.head += n
+            if not self.data_ready.is_set():
+                self.data_ready.set()
+            return n
+        first = min(n, self.capacity - pos)
+        self.buf[pos:pos + first] = samples[:first]
+        self.buf[:n - first] = samples[first:n]
+        # Espejo del principio detrás del final (lecturas contiguas)
+        if pos < self.max_read:
+            end = min(pos + first, self.max_read)
+            self.buf[self.capacity + pos:self.capacity + end] = self.buf[pos:end]
+        if n - first:
+            end = min(n - first, self.max_read)
+            self.buf[self.capacity:self.capacity + end] = self.buf[:end]
+        self.head += n
+        # El consumidor borra el aviso antes de dormir: casi nunca hace falta
+        if not self.data_ready.is_set():
+            self.data_ready.set()
+        return n
+
+    def wait(self, n, timeout=None, until=None):
+        """Consumidor: espera a tener n muestras (o a que until() valga)
+
+        Devuelve False si vence el timeout.
+        """
+        while self.available() < n and not (until and until()):
+            self.data_ready.clear()
+            # Volver a mirar tras clear(): el productor pudo escribir entre medias
+            if self.available() >= n or (until and until()):
+                break
+            if not self.data_ready.wait(timeout):
+                return False
+        return True
+
+    def peek(self, n):
+        """Consumidor: vista de las n muestras más antiguas (n <= max_read)"""
+        pos = self.tail % self.capacity
+        return self.buf[pos:pos + n]
+
+    def advance(self, n):
+        """Consumidor: libera n muestras para que el productor las reutilice"""
+        self.tail += n
+
+    def clear(self):
+        """Consumidor: descarta todo lo pendiente"""
+        self.tail = self.head
+
+    def wake(self):
+        """Despierta a un consumidor en wait() (cambió until())"""
+        self.data_ready.set()
+
+
+class AudioQueue:
+    """Cola acotada de audio con política de desbordamiento y contadores
+
+    Políticas al llenarse:
+      - drop-oldest: se descarta el bloque más antiguo
+      - drop-silence-first: se descarta el silencio más antiguo, y si no
+        hay, el bloque más antiguo
+      - block: la captura espera (el retraso no crece, pero ALSA desborda)
+
+    Los marcadores (QUEUE_MARKERS) no ocupan sitio ni se descartan nunca.
+    El consumidor espera sin timeout: solo despierta con audio, con
+    wake() o con close().
+    """
+
+    POLICIES = ('drop-oldest', 'drop-silence-first', 'block')
+
+    def __init__(self, maxsize, policy='drop-oldest'):
+        if policy not in self.POLICIES:
+            print(f"⚠️ Política de cola desconocida '{policy}', usando drop-oldest")
+            policy = 'drop-oldest'
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.items = deque()  # (data, silent, captured_at)
+        self.size = 0         # Bloques de audio en cola (sin marcadores)
+        self.unfinished = 0   # Encolados y aún sin task_done()
+        self.cond = threading.Condition()
+        self.woken = False    # wake(): el consumidor debe revisar su estado
+        self.closed = False   # close(): no entra nada más
+        # Contadores
+        self.high_water = 0
+        self.dropped_chunks = 0
+
+    def put(self, data, silent=False, captured_at=None):
+        """Encola un bloque aplicando la política si la cola está llena"""
+        with self.cond:
+            if self.closed:
+                return
+            if data not in QUEUE_MARKERS:
+                if self.size >= self.maxsize:
+                    if self.policy == 'block':
+                        while self.size >= self.maxsize and not self.closed:
+                            self.cond.wait()
+                        if self.closed:
+                            return  # close() durante la espera: no encolar
+                    else:
+                        self._drop()
+                self.size += 1
+                self.high_water = max(self.high_water, self.size)
+            self.items.append((data, silent, captured_at or time.monotonic()))
+            self.unfinished += 1
+            self.cond.notify_all()
+
+    def _drop(self):
+        """Descarta un bloque de audio según la política"""
+        victim = None
+        if self.policy == 'drop-silence-first':
+            victim = next((item for item in self.items
+                           if item[1] and item[0] not in QUEUE_MARKERS), None)
+        if victim is None:
+            victim = next(item for item in self.items if item[0] not in QUEUE_MARKERS)
+        self.items.remove(victim)
+        self.size -= 1
+        self.unfinished -= 1
+        self.dropped_chunks += 1
+
+    def get(self, timeout=None):
+        """Saca el siguiente bloque: (data, captured_at)
+
+        Lanza queue.Empty si vence el timeout o si alguien llamó a wake().
+        Devuelve (None, None) cuando la cola está cerrada y vacía.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items or self.woken or self.closed,
+                                      timeout) or not self.items:
+                self.woken = False
+                if self.closed:
+                    return None, None
+                raise queue.Empty
+            data, _, captured_at = self.items.popleft()
+            if data not in QUEUE_MARKERS:
+                self.size -= 1
+            self.cond.notify_all()
+            return data, captured_at
+
+    def get_nowait(self):
+        return self.get(timeout=0)
+
+    def wake(self):
+        """Despierta al consumidor sin darle audio (p. ej. cambió un plazo)"""
+        with self.cond:
+            self.woken = True
+            self.cond.notify_all()
+
+    def close(self):
+        """Fin de la entrada: el consumidor vacía lo que queda y termina"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def task_done(self):
+        """El consumidor terminó con un bloque (como queue.Queue)"""
+        with self.cond:
+            self.unfinished -= 1
+            self.cond.notify_all()
+
+    def join(self):
+        """Espera a que todo lo encolado se haya procesado"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.unfinished <= 0)
+
+    def stats(self):
+        """Resumen de profundidad máxima y descartes"""
+        return (f"Cola: máx {self.high_water}/{self.maxsize} bloques, "
+                f"{self.dropped_chunks} descartados ({self.policy})")
+
+
+class CorrectionEngine:
+    """Correcciones de palabras en una sola pasada
+
+    La tabla se compila una vez en una regex con forma de trie (las
+    palabras comparten prefijos), así el coste depende de la longitud del
+    texto y no del número de correcciones. Solo se corrigen palabras
+    completas: "ano" ya no convierte "mano" en "maño".
+    """
+
+    def __init__(self, corrections):
+        self.table = {wrong.lower(): right for wrong, right in corrections.items() if wrong}
+        self.pattern = None
+        if self.table:
+            self.pattern = re.compile(
+                r'(?<!\w)' + self._trie_regex(self.table) + r'(?!\w)',
+                re.IGNORECASE
+            )
+
+    @staticmethod
+    def _trie_regex(words):
+        """Regex equivalente a una alternancia de palabras, agrupada por prefijos"""
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = {}  # Fin de palabra
+
+        def build(node):
+            alts = [re.escape(char) + build(child)
+                    for char, child in sorted(node.items()) if char]
+            if not alts:
+                return ''
+            group = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+            if '' in node:
+                # Palabra completa aquí o más larga: la más larga primero
+                return f'(?:{group})?'
+            return group
+
+        return build(trie)
+
+    def _replace(self, match):
+        found = match.group(0)
+        right = self.table[found.lower()]
+        # Los reemplazos con mayúsculas (nombres propios) se respetan tal cual
+        if right != right.lower():
+            return right
+        if found.isupper() and len(found) > 1:
+            return right.upper()
+        if found[0].isupper():
+            return right[0].upper() + right[1:]
+        return right
+
+    def apply(self, text):
+        """Aplica todas las correcciones manteniendo mayúsculas"""
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(self._replace, text)
+
+
+# Variantes fonéticas de las palabras mágicas para enviar Enter
+# ("intro", "dentro", "adentro", "entro", "entra" son intercambiables)
+ENTER_VARIANTS = ["intro", "entro", "dentro", "adentro", "in tro", "en tro", "entra"]
+
+
+def get_enter_keywords(enter_words):
+    """Palabras que envían Enter: las de la config + "dentro" + variantes"""
+    return list(dict.fromkeys(list(enter_words) + ["dentro"] + ENTER_VARIANTS))
+
+
+class CommandRegistry:
+    """Registro de comandos de voz
+
+    Las frases exactas van en un dict y los comandos con argumento
+    ("busca X") en un trie de palabras, así cada frase se resuelve con una
+    sola búsqueda proporcional a su número de palabras, sin importar
+    cuántos comandos haya registrados.
+    """
+
+    def __init__(self):
+        self.exact = {}       # "borra todo" -> (nombre, handler)
+        self.prefix_trie = {}  # {"noticias": {"de": {...}, None: (nombre, handler)}}
+        self.names = {}        # nombre -> (tipo, frases)
+
+    def add_exact(self, name, phrases, handler):
+        """Registra frases exactas; handler() sin argumentos"""
+        for phrase in phrases:
+            self.exact[' '.join(phrase.lower().split())] = (name, handler)
+        self.names.setdefault(name, ('exacto', []))[1].extend(phrases)
+
+    def add_prefix(self, name, prefixes, handler):
+        """Registra prefijos; handler(arg) recibe el resto de la frase"""
+        for prefix in prefixes:
+            node = self.prefix_trie
+            for token in prefix.lower().split():
+                node = node.setdefault(token, {})
+            node[None] = (name, handler)
+        self.names.setdefault(name, ('prefijo', []))[1].extend(prefixes)
+
+    def match(self, text):
+        """Busca el comando de una frase: (nombre, callable) o None"""
+        tokens = text.split()
+        key = ' '.join(tokens).lower()
+        if key in self.exact:
+            return self.exact[key]
+        
+        # Prefijo más largo que deje argumento ("noticias de X" > "noticias X")
+        found = None
+        node = self.prefix_trie
+        for i, token in enumerate(tokens[:-1]):
+            node = node.get(token.lower())
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], i + 1)
+        if found is None:
+            return None
+        (name, handler), n = found
+        arg = ' '.join(tokens[n:])
+        return name, lambda: handler(arg)
+
+    def grammar(self):
+        """Frases para una gramática cerrada de Vosk
+
+        Solo entran las frases exactas: los comandos con argumento ("busca
+        X") necesitan vocabulario abierto y siguen yendo por el dictado.
+        "[unk]" recoge lo que no es un comando en vez de forzar uno.
+        """
+        return sorted(self.exact) + ['[unk]']
+
+    def describe(self):
+        """Lista de (nombre, tipo, frases) de los comandos registrados"""
+        return [(name, kind, phrases) for name, (kind, phrases) in self.names.items()]
+
+
+# === SALIDA DE TEXTO (SINKS) ===
+# Códigos de tecla de Linux (input-event-codes.h) para ydotool y uinput
+LINUX_KEYCODES = {
+    'esc': 1, 'backspace': 14, 'tab': 15, 'return': 28, 'enter': 28,
+    'ctrl': 29, 'shift': 42, 'alt': 56, 'space': 57, 'delete': 111,
+    'minus': 12, 'equal': 13, 'comma': 51, 'dot': 52, 'slash': 53,
+    'semicolon': 39, 'apostrophe': 40,
+}
+for _row, _first in (("1234567890", 2), ("qwertyuiop", 16), ("asdfghjkl", 30), ("zxcvbnm", 44)):
+    for _offset, _char in enumerate(_row):
+        LINUX_KEYCODES[_char] = _first + _offset
+
+# Caracteres que un teclado virtual US puede escribir: char -> (tecla, shift)
+US_KEYMAP = {' ': ('space', False), '\n': ('return', False), '-': ('minus', False),
+             ',': ('comma', False), '.': ('dot', False), ';': ('semicolon', False),
+             '/': ('slash', False), "'": ('apostrophe', False), '=': ('equal', False),
+             ':': ('semicolon', True), '?': ('slash', True), '!': ('1', True),
+             '"': ('apostrophe', True), '_': ('minus', True)}
+for _char in "abcdefghijklmnopqrstuvwxyz":
+    US_KEYMAP[_char] = (_char, False)
+    US_KEYMAP[_char.upper()] = (_char, True)
+for _char in "1234567890":
+    US_KEYMAP[_char] = (_char, False)
+
+# Nombres de tecla de xdotool (keysyms de X11)
+XDOTOOL_KEYS = {'return': 'Return', 'enter': 'Return', 'backspace': 'BackSpace',
+                'delete': 'Delete', 'tab': 'Tab', 'esc': 'Escape', 'space': 'space'}
+
+
+class OutputSink:
+    """Destino de las pulsaciones: escribe texto y pulsa combinaciones
+
+    Trocea el texto en órdenes de como mucho chunk_chars caracteres y, si
+    hay portapapeles, pega de una vez los textos largos. Lleva la cuenta
+    de caracteres y tiempo para medir el rendimiento (caracteres/s).
+    """
+
+    name = 'base'
+
+    def __init__(self, chunk_chars=200, key_delay_ms=0, clipboard=None,
+                 clipboard_min_chars=0):
+        self.chunk_chars = max(1, chunk_chars)
+        self.key_delay_ms = key_delay_ms
+        self.clipboard = clipboard
+        self.clipboard_min_chars = clipboard_min_chars
+        self.chars = 0
+        self.seconds = 0.0
+
+    def type(self, text):
+        """Escribe el texto donde esté el cursor"""
+        if not text:
+            return
+        start = time.perf_counter()
+        if self.clipboard and self.clipboard_min_chars and len(text) >= self.clipboard_min_chars:
+            self.clipboard.paste(text, self)
+        else:
+            for i in range(0, len(text), self.chunk_chars):
+                self._type(text[i:i + self.chunk_chars])
+        self.seconds += time.perf_counter() - start
+        self.chars += len(text)
+
+    def press(self, *keys):
+        """Pulsa una combinación de teclas ('ctrl', 'a')"""
+        self._press(keys)
+
+    def erase(self, count):
+        """Borra los últimos caracteres escritos (Backspace x count)"""
+        for _ in range(count):
+            self._press(('backspace',))
+
+    def _type(self, text):
+        raise NotImplementedError
+
+    def _press(self, keys):
+        raise NotImplementedError
+
+    def stats(self):
+        """Rendimiento de la inyección de texto"""
+        rate = self.chars / self.seconds if self.seconds else 0.0
+        return f"Salida {self.name}: {self.chars} caracteres, {rate:.0f} car/s"
+
+
+class PyAutoGUISink(OutputSink):
+    """pyautogui.typewrite: lento y solo ASCII (se pierden ñ y tildes)"""
+
+    name = 'pyautogui'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Import aquí: pyautogui necesita un display al importarse
+        import pyautogui
+        self.pyautogui = pyautogui
+
+    def _type(self, text):
+        self.pyautogui.typewrite(text, interval=self.key_delay_ms / 1000)
+
+    def _press(self, keys):
+        for key in keys:
+            self.pyautogui.keyDown(key)
+        for key in reversed(keys):
+            self.pyautogui.keyUp(key)
+
+
+class XdotoolSink(OutputSink):
+    """xdotool type en bloques (X11/XWayland, Unicode completo)"""
+
+    name = 'xdotool'
+
+    def _type(self, text):
+        subprocess.run(['xdotool', 'type', '--delay', str(self.key_delay_ms), '--', text],
+                       check=False)
+
+    def _press(self, keys):
+        combo = '+'.join(XDOTOOL_KEYS.get(key, key) for key in keys)
+        subprocess.run(['xdotool', 'key', '--', combo], check=False)
+
+    def erase(self, count):
+        if count:
+            subprocess.run(['xdotool', 'key', '--repeat', str(count), 'BackSpace'], check=False)
+
+
+class YdotoolSink(OutputSink):
+    """ydotool type en bloques (Wayland, necesita el demonio ydotoold)"""
+
+    name = 'ydotool'
+
+    def _type(self, text):
+        subprocess.run(['ydotool', 'type', '--key-delay', str(self.key_delay_ms), '--', text],
+                       check=False)
+
+    def _press(self, keys):
+        codes = [LINUX_KEYCODES[key] for key in keys]
+        events = [f"{code}:1" for code in codes] + [f"{code}:0" for code in reversed(codes)]
+        subprocess.run(['ydotool', 'key'] + events, check=False)
+
+
+class UinputSink(OutputSink):
+    """Teclado virtual uinput (python-evdev, distribución US)
+
+    Lo que no se puede teclear con la distribución US (ñ, tildes...) se
+    pega por portapapeles si lo hay.
+    """
+
+    name = 'uinput'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        from evdev import UInput, ecodes
+        self.ecodes = ecodes
+        self.device = UInput({ecodes.EV_KEY: sorted(set(LINUX_KEYCODES.values()))},
+                             name='voice-typing')
+
+    def _tap(self, codes):
+        for code in codes:
+            self.device.write(self.ecodes.EV_KEY, code, 1)
+        for code in reversed(codes):
+            self.device.write(self.ecodes.EV_KEY, code, 0)
+        self.device.syn()
+        if self.key_delay_ms:
+            time.sleep(self.key_delay_ms / 1000)
+
+    def _type(self, text):
+        pending = ''  # Tramo sin tecla en la distribución US
+        for char in text:
+            if char not in US_KEYMAP:
+                pending += char
+                continue
+            if pending:
+                self._paste_unmapped(pending)
+                pending = ''
+            key, shift = US_KEYMAP[char]
+            codes = [LINUX_KEYCODES[key]]
+            self._tap([LINUX_KEYCODES['shift']] + codes if shift else codes)
+        if pending:
+            self._paste_unmapped(pending)
+
+    def _paste_unmapped(self, text):
+        if self.clipboard:
+            self.clipboard.paste(text, self)
+        else:
+            print(f"⚠️ uinput no puede escribir '{text}' (sin portapapeles)")
+
+    def _press(self, keys):
+        self._tap([LINUX_KEYCODES[key] for key in keys])
+
+
+class RecordingSink(OutputSink):
+    """No escribe nada: guarda lo que se habría escrito (pruebas, benchmarks)"""
+
+    name = 'null'
+
+    def __init__(self, record=True, **kwargs):
+        super().__init__(**kwargs)
+        self.record = record
+        self.events = []  # ('type', texto) / ('keys', teclas)
+
+    def _type(self, text):
+        if self.record:
+            self.events.append(('type', text))
+
+    def _press(self, keys):
+        if self.record:
+            self.events.append(('keys', tuple(keys)))
+
+    def erase(self, count):
+        if self.record and count:
+            self.events.append(('erase', count))
+
+    def text(self):
+        """Texto escrito hasta ahora (las teclas no cuentan, los borrados sí)"""
+        text = ''
+        for kind, value in self.events:
+            if kind == 'type':
+                text += value
+            elif kind == 'erase':
+                text = text[:-value]
+        return text
+
+
+class Clipboard:
+    """Pega texto por portapapeles (wl-copy o xclip) + Ctrl+V"""
+
+    def __init__(self, command):
+        self.command = command
+
+    @classmethod
+    def detect(cls):
+        """Herramienta de portapapeles disponible, o None"""
+        if os.environ.get('WAYLAND_DISPLAY') and shutil.which('wl-copy'):
+            return cls(['wl-copy'])
+        if shutil.which('xclip'):
+            return cls(['xclip', '-selection', 'clipboard'])
+        return None
+
+    def paste(self, text, sink):
+        subprocess.run(self.command, input=text.encode('utf-8'), check=False)
+        sink.press('ctrl', 'v')
+
+
+OUTPUT_SINKS = {
+    'pyautogui': PyAutoGUISink,
+    'xdotool': XdotoolSink,
+    'ydotool': YdotoolSink,
+    'uinput': UinputSink,
+    'null': RecordingSink,
+}
+
+
+def create_output_sink(config):
+    """Crea el sink configurado ("auto" elige la mejor herramienta instalada)"""
+    name = config.get('output_sink', 'auto')
+    if name == 'auto':
+        # Wayland primero: XWayland también pone DISPLAY, pero xdotool solo
+        # llega a las ventanas X, no a las nativas de Wayland
+        wayland = (os.environ.get('WAYLAND_DISPLAY')
+                   or os.environ.get('XDG_SESSION_TYPE') == 'wayland')
+        if wayland and shutil.which('ydotool'):
+            name = 'ydotool'
+        elif os.environ.get('DISPLAY') and shutil.which('xdotool'):
+            name = 'xdotool'
+            if wayland:
+                print("⚠️ Wayland sin ydotool: xdotool solo escribe en ventanas XWayland")
+        else:
+            name = 'pyautogui'
+    if name not in OUTPUT_SINKS:
+        print(f"⚠️ Salida desconocida '{name}', usando pyautogui")
+        name = 'pyautogui'
+    
+    options = dict(
+        chunk_chars=config.get('output_chunk_chars', 200),
+        key_delay_ms=config.get('output_key_delay_ms', 0),
+        clipboard=Clipboard.detect() if name != 'null' else None,
+        clipboard_min_chars=config.get('output_clipboard_min_chars', 120),
+    )
+    try:
+        sink = OUTPUT_SINKS[name](**options)
+    except Exception as e:
+        print(f"⚠️ No se pudo usar la salida {name}: {e}, usando pyautogui")
+        sink = PyAutoGUISink(**options)
+    print(f"⌨️ Salida de texto: {sink.name}")
+    return sink
+
+
+# Sink activo: lo usan la escritura y los comandos
+output_sink = None
+
+
+def set_output_sink(sink):
+    global output_sink
+    output_sink = sink
+
+
+# === COMANDOS INTEGRADOS ===
+def press_keys(*keys):
+    """Pulsa una combinación de teclas (ctrl+a, return...)"""
+    output_sink.press(*keys)
+
+
+def cmd_delete_word():
+    press_keys('ctrl', 'backspace')
+    print("⌫ Última palabra borrada")
+
+
+def cmd_delete_all():
+    press_keys('ctrl', 'a')
+    press_keys('delete')
+    print("🗑️ Todo el texto borrado")
+
+
+def cmd_enter():
+    press_keys('return')
+    print("⏎ Enter enviado")
+
+
+def launch(command, message):
+    """Devuelve un handler que lanza un programa"""
+    def handler():
+        subprocess.Popen(command)
+        print(message)
+    return handler
+
+
+def cmd_search(query):
+    search_url = f"https://www.google.com/search?q={urllib.parse.quote(query)}"
+    subprocess.Popen(['xdg-open', search_url])
+    print(f"🔍 Buscando: {query}")
+
+
+def cmd_news(query):
+    # Corregir "winona rider" si está mal transcrito
+    query_clean = query.replace("winona rider", "winona ryder")
+    news_url = f"https://news.google.com/search?q={urllib.parse.quote(query_clean)}&hl=es"
+    subprocess.Popen(['xdg-open', news_url])
+    print(f"📰 Buscando noticias de: {query_clean}")
+
+
+def register_builtin_commands(registry, config):
+    """Comandos de siempre (todos los del navegador usan xdg-open)"""
+    # COMANDOS DE BORRADO
+    registry.add_exact('borra', ["borra", "borrar", "borra la palabra", "borrar palabra"],
+                       cmd_delete_word)
+    registry.add_exact('borra todo', ["borra todo", "borrar todo", "borra todo el texto",
+                                      "borrar todo el texto"], cmd_delete_all)
+    
+    # COMANDOS DE SISTEMA
+    registry.add_exact('navegador', [f"abre {app}" for app in
+                                     ["firefox", "navegador", "el navegador", "chrome", "brave"]],
+                       launch(['xdg-open', 'https://'], "🌐 Navegador abierto"))
+    registry.add_exact('terminal', ["abre terminal", "abre consola", "abre konsole"],
+                       launch(['konsole'], "💻 Terminal abierta"))
+    registry.add_exact('spotify', ["abre spotify", "abre música", "abre musica"],
+                       launch(['spotify'], "🎵 Spotify abierto"))
+    registry.add_exact('vscode', ["abre vscode"], launch(['code'], "📝 VSCode abierto"))
+    registry.add_exact('youtube', ["youtube", "abre youtube", "abrir youtube"],
+                       launch(['xdg-open', 'https://youtube.com'], "📺 YouTube abierto"))
+    registry.add_exact('clima', ["clima", "tiempo", "qué tiempo hace", "que tiempo hace"],
+                       launch(['xdg-open', 'https://www.google.com/search?q=tiempo+madrid'],
+                              "🌤️ Consultando clima de Madrid"))
+    registry.add_prefix('busca', ["busca", "buscar"], cmd_search)
+    registry.add_prefix('noticias', ["noticias de", "noticias sobre", "noticias"], cmd_news)
+    
+    # Palabra mágica sola = Enter
+    registry.add_exact('enter', get_enter_keywords(config.get('enter_words', [])), cmd_enter)
+
+
+def register_config_commands(registry, config):
+    """Comandos definidos en la config ("commands") y módulos plugin"""
+    for i, spec in enumerate(config.get('commands', [])):
+        name = spec.get('name') or ' / '.join(spec.get('say') or spec.get('prefix') or [str(i)])
+        if 'run' in spec:
+            def action(arg='', argv=spec['run']):
+                subprocess.Popen([part.replace('{query}', arg) for part in argv])
+        elif 'open' in spec:
+            def action(arg='', url=spec['open']):
+                subprocess.Popen(['xdg-open', url.replace('{query}', urllib.parse.quote(arg))])
+        elif 'keys' in spec:
+            def action(arg='', keys=spec['keys']):
+                press_keys(*keys)
+        else:
+            print(f"⚠️ Comando sin acción en la config: {spec}")
+            continue
+        
+        if spec.get('say'):
+            registry.add_exact(name, spec['say'], action)
+        if spec.get('prefix'):
+            registry.add_prefix(name, spec['prefix'], action)
+    
+    for module_name in config.get('command_plugins', []):
+        try:
+            importlib.import_module(module_name).register(registry)
+            print(f"🧩 Plugin de comandos: {module_name}")
+        except Exception as e:
+            print(f"⚠️ Error cargando plugin {module_name}: {e}")
+
+
+def build_command_registry(config):
+    """Construye el registro de comandos una sola vez al arrancar"""
+    registry = CommandRegistry()
+    register_builtin_commands(registry, config)
+    register_config_commands(registry, config)
+    return registry
+
+
+def list_commands(config):
+    """Imprime los comandos registrados"""
+    for name, kind, phrases in build_command_registry(config).describe():
+        print(f"  {name:<16} {kind:<8} {', '.join(phrases)}")
+
+
+def benchmark_commands(config, extra=5000, rounds=20000):
+    """Mide el coste de encontrar el comando con pocos y muchos comandos"""
+    utterances = ["borra todo", "busca recetas de paella", "noticias de la liga",
+                  "esto es una frase normal de dictado sin comando", "abre terminal"]
+    small = build_command_registry(config)
+    large = build_command_registry(config)
+    for i in range(extra):
+        large.add_exact(f'extra{i}', [f"comando extra {i}"], lambda: None)
+        large.add_prefix(f'extra-prefijo{i}', [f"prefijo {i}"], lambda arg: None)
+    
+    for label, registry in ((f"{len(small.names)} comandos", small),
+                            (f"{len(large.names)} comandos", large)):
+        start = time.perf_counter()
+        for i in range(rounds):
+            registry.match(utterances[i % len(utterances)])
+        elapsed = time.perf_counter() - start
+        print(f"⏱️ {label}: {1e6 * elapsed / rounds:.2f} µs por frase")
+
+
+def run_output_actions(actions):
+    """Ejecuta acciones de salida, juntando escrituras consecutivas"""
+    pending = ''
+    for kind, value in actions + [('end', None)]:
+        if kind == 'type':
+            pending += value
+            continue
+        if pending:
+            output_sink.type(pending)
+            pending = ''
+        try:
+            if kind == 'keys':
+                output_sink.press(*value)
+            elif kind == 'erase':
+                output_sink.erase(value)
+            elif kind == 'call':
+                value()
+        except Exception as e:
+            print(f"⚠️ Error ejecutando comando: {e}")
+
+
+def streamed_diff(streamed, actions):
+    """Corrige lo ya escrito en streaming para que quede el resultado final
+
+    Compara lo escrito con el texto que escribirían las acciones finales y
+    devuelve solo lo mínimo: borrar desde la primera diferencia y escribir
+    el resto. Si la frase final es un comando, se borra todo lo escrito.
+    """
+    typed = ''
+    i = 0
+    while i < len(actions) and actions[i][0] == 'type':
+        typed += actions[i][1]
+        i += 1
+    common = len(os.path.commonprefix([streamed, typed]))
+    diff = []
+    if len(streamed) > common:
+        diff.append(('erase', len(streamed) - common))
+    if typed[common:]:
+        diff.append(('type', typed[common:]))
+    return diff + actions[i:]
+
+
+def typed_text(actions):
+    """Texto que escriben unas acciones, o None si hacen algo más que escribir"""
+    if not actions or any(kind != 'type' for kind, _ in actions):
+        return None
+    return ''.join(value for _, value in actions)
+
+
+class PartialStabilizer:
+    """Decide qué palabras de los resultados parciales ya son estables
+
+    Una palabra es estable cuando no ha cambiado en los últimos N
+    parciales. La última palabra del parcial nunca lo es (puede estar a
+    medias).
+    """
+
+    def __init__(self, stable_count=3):
+        self.history = deque(maxlen=max(1, stable_count))
+        self.committed = []  # Palabras ya enviadas a escribir en esta frase
+
+    def update(self, partial):
+        """Nuevo parcial: devuelve las palabras que pasan a ser estables"""
+        words = partial.split()
+        self.history.append(words)
+        if len(self.history) < self.history.maxlen:
+            return []
+        stable = os.path.commonprefix(list(self.history))[:len(words) - 1]
+        # Si Vosk cambió de idea sobre algo ya escrito, lo arregla el final
+        if len(stable) <= len(self.committed) or stable[:len(self.committed)] != self.committed:
+            return []
+        new = stable[len(self.committed):]
+        self.committed = list(stable)
+        return new
+
+    def reset(self):
+        """Fin de frase"""
+        self.history.clear()
+        self.committed = []
+
+
+class OutputWorker:
+    """Hilo de salida con su propia cola
+
+    El reconocimiento nunca espera a que se escriba el texto ni a que se
+    lance un programa. Las frases que llegan mientras se escribe se
+    juntan en una sola inyección, respetando el orden.
+
+    En modo streaming recibe también palabras estables de los parciales,
+    las escribe al momento y, con el resultado final, corrige solo la
+    diferencia. Igual con la segunda pasada: submit_patch() rehace la
+    última frase escrita, si no se ha escrito nada después.
+    """
+
+    def __init__(self, prepare, correct=None, on_done=None, metrics=None, exporter=None,
+                 patch_window=15.0):
+        self.prepare = prepare   # texto -> lista de acciones
+        self.correct = correct   # Correcciones para las palabras en streaming
+        self.on_done = on_done   # Se llama tras cada inyección
+        self.metrics = metrics
+        self.exporter = exporter
+        self.queue = queue.Queue()
+        self.merged = 0          # Frases que se juntaron con otras
+        self.streamed = ''       # Escrito en streaming de la frase en curso
+        self.patch_window = patch_window
+        self.submitted = 0       # Frases enviadas (numeradas para submit_patch)
+        self.finals = 0          # Frases ya procesadas por el hilo
+        self.last_typed = None   # (número, cuándo, texto) de la última frase escrita
+        self.patched = 0
+        self.patches_skipped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, text, trace=None):
+        """Resultado final de una frase (trace: tiempos de sus etapas)
+
+        Devuelve el número de la frase, para submit_patch().
+        """
+        self.submitted += 1
+        self.queue.put(('final', text, trace))
+        return self.submitted
+
+    def submit_patch(self, number, text):
+        """Nuevo texto para una frase ya escrita (segunda pasada)"""
+        self.queue.put(('patch', (number, text), None))
+
+    def submit_partial(self, words):
+        """Palabras estables de la frase en curso (modo streaming)"""
+        self.queue.put(('stream', words, None))
+
+    def build_actions(self, kind, value):
+        if kind == 'stream':
+            # Empieza otra frase: la anterior ya no se puede corregir
+            self.last_typed = None
+            piece = ' ' + ' '.join(value)
+            if self.correct:
+                piece = self.correct(piece)
+            self.streamed += piece
+            return [('type', piece)]
+        if kind == 'patch':
+            return self.build_patch(*value)
+        actions = self.prepare(value) if value else []
+        self.finals += 1
+        typed = typed_text(actions)
+        self.last_typed = (self.finals, time.monotonic(), typed) if typed else None
+        if self.streamed:
+            actions = streamed_diff(self.streamed, actions)
+            self.streamed = ''
+        return actions
+
+    def build_patch(self, number, text):
+        """Borra y reescribe solo lo que cambia de la última frase escrita
+
+        Si después se escribió otra cosa, pasó demasiado tiempo o el
+        cambio no es solo texto (un comando, un Enter), no se toca nada.
+        """
+        last = self.last_typed
+        if (last is None or last[0] != number
+                or time.monotonic() - last[1] > self.patch_window):
+            self.patches_skipped += 1
+            return []
+        actions = self.prepare(text)
+        typed = typed_text(actions)
+        if typed is None:
+            self.patches_skipped += 1
+            return []
+        self.last_typed = (number, last[1], typed)
+        self.patched += 1
+        return streamed_diff(last[2], actions)
+
+    def stop(self):
+        """Termina el hilo cuando acabe lo pendiente (y lo espera)"""
+        self.queue.put(None)
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            # Todo lo que llegó mientras escribíamos va en la misma tanda
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+            self.process_batch([item for item in batch if item is not None])
+            for _ in batch:
+                self.queue.task_done()
+
+    def process_batch(self, batch):
+        """Escribe una tanda de frases como una sola inyección"""
+        if not batch:
+            return
+        self.merged += len(batch) - 1
+        
+        actions = []
+        traces = []
+        for kind, value, trace in batch:
+            start = time.monotonic()
+            actions.extend(self.build_actions(kind, value))
+            if trace is not None:
+                trace['dispatch'] = time.monotonic() - start
+                traces.append(trace)
+        try:
+            start = time.monotonic()
+            run_output_actions(actions)
+            self.record(traces, start, time.monotonic())
+            if self.on_done:
+                self.on_done()
+        except Exception as e:
+            print(f"⚠️ Error escribiendo: {e}")
+
+    def record(self, traces, inject_start, inject_end):
+        """Cierra los tiempos de las frases de una tanda"""
+        if self.metrics is None:
+            return
+        self.metrics.observe('inject', inject_end - inject_start)
+        for trace in traces:
+            trace['inject'] = inject_end - inject_start
+            # Del final del audio de la frase al primer carácter escrito
+            trace['utterance'] = inject_start - trace.pop('audio_end')
+            self.metrics.observe('dispatch', trace['dispatch'])
+            self.metrics.observe('utterance', trace['utterance'])
+            self.metrics.inc('utterances')
+            if self.exporter:
+                self.exporter.record_utterance(trace)
+
+
+# === MÉTRICAS ===
+class Metrics:
+    """Latencias por etapa (p50/p95/p99) y contadores del pipeline
+
+    Etapas: resample, queue_wait, accept, result, dispatch, inject y
+    utterance (fin del audio de la frase -> primer carácter). La latencia
+    de entrada del dispositivo es fija y va como gauge, no como etapa.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=2000):
+        self.lock = threading.Lock()
+        self.window = window
+        self.samples = {}   # etapa -> últimas observaciones (s)
+        self.sums = {}
+        self.counts = {}
+        self.counters = {}  # chunks, audio_seconds, accept_seconds, utterances...
+        self.gauges = {}    # queue_depth...
+        self.started = time.monotonic()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+                self.sums[stage] = 0.0
+                self.counts[stage] = 0
+            self.samples[stage].append(seconds)
+            self.sums[stage] += seconds
+            self.counts[stage] += 1
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def snapshot(self):
+        """Estado actual: cuantiles por etapa, contadores y derivados"""
+        with self.lock:
+            stages = {}
+            for stage, samples in self.samples.items():
+                ordered = sorted(samples)
+                stages[stage] = {
+                    'count': self.counts[stage],
+                    'sum': self.sums[stage],
+                    **{f"p{int(q * 100)}": ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+                       for q in self.QUANTILES}
+                }
+            counters = dict(self.counters)
+        uptime = time.monotonic() - self.started
+        audio = counters.get('audio_seconds', 0)
+        return {
+            'uptime_seconds': uptime,
+            'stages': stages,
+            'counters': counters,
+            'gauges': dict(self.gauges),
+            'real_time_factor': counters.get('accept_seconds', 0) / audio if audio else 0.0,
+            'chunks_per_second': counters.get('chunks', 0) / uptime if uptime else 0.0,
+        }
+
+    def prometheus_text(self):
+        """Formato de texto de Prometheus (textfile collector)"""
+        snap = self.snapshot()
+        lines = ['# TYPE voice_typing_stage_seconds summary']
+        for stage, data in sorted(snap['stages'].items()):
+            for q in self.QUANTILES:
+                lines.append(f'voice_typing_stage_seconds{{stage="{stage}",quantile="{q}"}} '
+                             f'{data[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'voice_typing_stage_seconds_sum{{stage="{stage}"}} {data["sum"]:.6f}')
+            lines.append(f'voice_typing_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+        for name, value in sorted(snap['counters'].items()):
+            lines.append(f'# TYPE voice_typing_{name}_total counter')
+            lines.append(f'voice_typing_{name}_total {value}')
+        gauges = dict(snap['gauges'], real_time_factor=snap['real_time_factor'],
+                      chunks_per_second=snap['chunks_per_second'],
+                      uptime_seconds=snap['uptime_seconds'])
+        for name, value in sorted(gauges.items()):
+            lines.append(f'# TYPE voice_typing_{name} gauge')
+            lines.append(f'voice_typing_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        """Resumen legible para la consola"""
+        snap = self.snapshot()
+        lines = [f"Métricas: RTF {snap['real_time_factor']:.3f}, "
+                 f"{snap['chunks_per_second']:.1f} bloques/s"]
+        for stage, data in sorted(snap['stages'].items()):
+            lines.append(f"   {stage:<11} p50 {1000 * data['p50']:7.1f}ms  "
+                         f"p95 {1000 * data['p95']:7.1f}ms  p99 {1000 * data['p99']:7.1f}ms  "
+                         f"({data['count']})")
+        return '\n'.join(lines)
+
+
+class MetricsExporter:
+    """Escribe las métricas periódicamente (Prometheus) o por frase (JSONL)
+
+    El fichero de Prometheus se reemplaza de forma atómica para que
+    node_exporter nunca lea uno a medias.
+    """
+
+    def __init__(self, metrics, fmt, path, interval=10):
+        self.metrics = metrics
+        self.fmt = fmt
+        self.path = os.path.expanduser(path)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        print(f"📈 Métricas ({fmt}): {self.path}")
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            if self.fmt == 'prometheus':
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w') as f:
+                    f.write(self.metrics.prometheus_text())
+                os.replace(tmp, self.path)
+            else:
+                self.append({'type': 'snapshot', 'time': time.time(), **self.metrics.snapshot()})
+        except Exception as e:
+            print(f"⚠️ Error exportando métricas: {e}")
+
+    def record_utterance(self, trace):
+        """Una línea JSONL por frase con sus tiempos por etapa"""
+        if self.fmt == 'jsonl':
+            self.append({'type': 'utterance', 'time': time.time(), **trace})
+
+    def append(self, record):
+        with self.lock, open(self.path, 'a') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def stop(self):
+        self.stop_event.set()
+        self.write()
+
+
+def create_metrics_exporter(metrics, config):
+    """Exportador configurado, o None si las métricas no se exportan"""
+    fmt = config.get('metrics_format')
+    if not fmt:
+        return None
+    if fmt not in ('prometheus', 'jsonl'):
+        print(f"⚠️ Formato de métricas desconocido '{fmt}'")
+        return None
+    return MetricsExporter(metrics, fmt, config.get('metrics_path'),
+                           config.get('metrics_interval_s', 10))
+
+
+# === DIARIO DE TRANSCRIPCIONES ===
+def search_tokens(text):
+    """Palabras para el índice: minúsculas y sin tildes ("Camión" = "camion")"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r"\w+", text)
+
+
+class TranscriptJournal:
+    """Diario append-only de frases reconocidas, con índice invertido
+
+    Cada segmento es un fichero JSONL (una línea compacta por frase) y su
+    índice (palabra -> offsets de las líneas que la contienen) va al lado
+    en .idx.json. Las escrituras van a un hilo propio que las junta y
+    hace fsync cada fsync_s, así el reconocimiento nunca espera al disco.
+    Buscar es intersecar listas de offsets y leer solo esas líneas.
+    """
+
+    def __init__(self, path, segment_bytes=16 << 20, fsync_s=2.0, writer=True):
+        self.path = os.path.expanduser(path)
+        self.segment_bytes = segment_bytes
+        self.fsync_s = fsync_s
+        self.lock = threading.Lock()
+        self.postings = {}     # palabra -> [(segmento, offset)]
+        self.segment_index = {}  # palabra -> [offset] del segmento activo
+        os.makedirs(self.path, exist_ok=True)
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        for number in segments:
+            index = self.load_index(number)
+        if segments:
+            self.segment_index = index
+        self.file = None
+        self.queue = None
+        if writer:
+            self.file = open(self.segment_path(self.segment), 'ab')
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def segment_path(self, number, ext='.jsonl'):
+        return os.path.join(self.path, f"segment-{number:06d}{ext}")
+
+    def segments(self):
+        names = glob.glob(os.path.join(self.path, 'segment-*.jsonl'))
+        return sorted(int(os.path.basename(name)[8:14]) for name in names)
+
+    def load_index(self, number):
+        """Carga el índice de un segmento e indexa lo que falte (tras un corte)"""
+        index, size = {}, 0
+        try:
+            with open(self.segment_path(number, '.idx.json')) as f:
+                saved = json.load(f)
+            index, size = saved['postings'], saved['size']
+        except (OSError, ValueError, KeyError):
+            pass
+        with open(self.segment_path(number), 'rb') as f:
+            f.seek(size)
+            offset = size
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Línea a medio escribir: se ignora
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = {}
+                for token in set(search_tokens(entry.get('text', ''))):
+                    index.setdefault(token, []).append(offset)
+                offset += len(line)
+        if offset != size:
+            self.save_index(number, index, offset)
+        for token, offsets in index.items():
+            self.postings.setdefault(token, []).extend((number, o) for o in offsets)
+        return index
+
+    def save_index(self, number, index, size):
+        tmp = self.segment_path(number, '.idx.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'size': size, 'postings': index}, f, separators=(',', ':'))
+        os.replace(tmp, self.segment_path(number, '.idx.json'))
+
+    def append(self, entry):
+        """Encola una frase (no bloquea: la escribe el hilo del diario)"""
+        if self.queue is not None:
+            self.queue.put(entry)
+
+    def run(self):
+        last_sync = time.monotonic()
+        dirty = False
+        running = True
+        while running:
+            timeout = max(0.0, last_sync + self.fsync_s - time.monotonic()) if dirty else None
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+            waiters = []
+            for entry in batch:
+                if isinstance(entry, threading.Event):
+                    waiters.append(entry)  # flush(): avisar cuando esté escrito
+                elif entry is not None:
+                    self.write(entry)
+                    dirty = True
+            if dirty and (not running or time.monotonic() - last_sync >= self.fsync_s):
+                os.fsync(self.file.fileno())
+                last_sync = time.monotonic()
+                dirty = False
+            for waiter in waiters:
+                waiter.set()
+        self.save_index(self.segment, self.segment_index, self.file.tell())
+        self.file.close()
+
+    def write(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        offset = self.file.tell()
+        self.file.write(line)
+        # La línea tiene que poder leerse antes de publicar sus offsets
+        # (flush al sistema; el fsync sigue yendo por tandas)
+        self.file.flush()
+        with self.lock:
+            for token in set(search_tokens(entry.get('text', ''))):
+                self.segment_index.setdefault(token, []).append(offset)
+                self.postings.setdefault(token, []).append((self.segment, offset))
+        if self.file.tell() >= self.segment_bytes:
+            self.rotate()
+
+    def rotate(self):
+        """Cierra el segmento (con su índice) y empieza otro"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.save_index(self.segment, self.segment_index, self.file.tell())
+        self.file.close()
+        with self.lock:
+            self.segment += 1
+            self.segment_index = {}
+        self.file = open(self.segment_path(self.segment), 'ab')
+
+    def search(self, query, limit=20):
+        """Frases que contienen todas las palabras, de la más reciente a la más antigua"""
+        tokens = set(search_tokens(query))
+        if not tokens:
+            return []
+        # Lo dictado hace un momento puede seguir en la cola del escritor
+        self.flush()
+        with self.lock:
+            lists = sorted((self.postings.get(token, []) for token in tokens), key=len)
+            hits = set(lists[0])
+            for postings in lists[1:]:
+                hits.intersection_update(postings)
+        results = []
+        handles = {}
+        try:
+            for number, offset in sorted(hits, reverse=True)[:limit]:
+                if number not in handles:
+                    handles[number] = open(self.segment_path(number), 'rb')
+                handles[number].seek(offset)
+                line = handles[number].readline()
+                if not line.endswith(b'\n'):
+                    continue  # Aún no está entera en el fichero
+                results.append(json.loads(line))
+        finally:
+            for f in handles.values():
+                f.close()
+        return results
+
+    def flush(self, timeout=1.0):
+        """Espera a que el escritor haya pasado al fichero todo lo encolado"""
+        if self.queue is None:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Escribe lo pendiente, hace fsync y guarda el índice"""
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+            self.queue = None
+
+
+def create_journal(config):
+    """Diario configurado, o None si está desactivado"""
+    if not config.get('journal_enabled', True):
+        return None
+    try:
+        return TranscriptJournal(config.get('journal_dir', DEFAULT_CONFIG['journal_dir']),
+                                 int(config.get('journal_segment_mb', 16) * (1 << 20)),
+                                 config.get('journal_fsync_s', 2.0))
+    except OSError as e:
+        print(f"⚠️ Diario desactivado: {e}")
+        return None
+
+
+def format_journal_entry(entry):
+    when = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['t']))
+    return f"{when}  {entry['text']}"
+
+
+def search_journal(query, config, limit=20):
+    """Búsqueda en el diario desde la línea de comandos"""
+    path = os.path.expanduser(config.get('journal_dir', DEFAULT_CONFIG['journal_dir']))
+    if not os.path.isdir(path):
+        print(f"❌ No hay diario en {path}")
+        return []
+    start = time.perf_counter()
+    journal = TranscriptJournal(path, writer=False)
+    loaded = time.perf_counter()
+    results = journal.search(query, limit)
+    done = time.perf_counter()
+    for entry in results:
+        print(format_journal_entry(entry))
+    print(f"🔎 {len(results)} resultados en {1000 * (done - loaded):.1f}ms "
+          f"(índice cargado en {1000 * (loaded - start):.0f}ms, "
+          f"{len(journal.segments())} segmentos)")
+    return results
+
+
+# Ritmo de refresco del indicador (ms)
+UI_POLL_MS = 50
+
+
+class UIState:
+    """Estado del indicador flotante, compartido entre hilos sin locks
+
+    Los hilos de trabajo solo asignan atributos (atómico con el GIL) y
+    nunca tocan Tk. El hilo de Tk lo consulta a ritmo fijo y solo
+    redibuja cuando el color cambia.
+    """
+
+    COLORS = {
+        'listening': '#e74c3c',  # Rojo = escuchando
+        'speaking': '#f39c12',   # Amarillo = procesando voz
+        'success': '#2ecc71',    # Flash verde = texto escrito
+        'paused': '#2ecc71',     # Verde = pausado
+        'loading': '#7f8c8d',    # Gris = cargando modelo
+        'command': '#9b59b6',    # Morado = esperando un comando
+    }
+
+    def __init__(self):
+        self.status = 'listening'
+        self.paused = False
+        self.command = False
+        self.flash_until = 0.0
+
+    def flash(self, seconds=0.1):
+        """Flash verde durante unos instantes"""
+        self.flash_until = time.monotonic() + seconds
+
+    def color(self):
+        if self.paused:
+            return self.COLORS['paused']
+        if time.monotonic() < self.flash_until:
+            return self.COLORS['success']
+        if self.command:
+            return self.COLORS['command']
+        return self.COLORS[self.status]
+
+
+# === FUENTES DE AUDIO ===
+class AudioSource:
+    """Fuente de audio int16 mono
+
+    open() fija el tamaño de bloque para la frecuencia nativa de la
+    fuente (rate), así el pipeline sabe si tiene que convertir o no.
+    read() devuelve un bloque, b'' si no hay nada ahora mismo o None
+    cuando la fuente se ha terminado. El bloque puede ser una vista de un
+    buffer de la fuente (memoryview): solo vale hasta el siguiente read().
+    """
+
+    name = 'base'
+
+    def __init__(self, rate=16000):
+        self.rate = rate
+        self.chunk_frames = None
+        self.latency = 0.0  # Latencia propia de la fuente (s)
+        self.overruns = 0   # Audio perdido por no leer a tiempo
+        self.strict = False  # open() sin caer a otro dispositivo (reintentos)
+        self.fallback = False  # Abierta en un dispositivo de reserva
+
+    def open(self, chunk_ms):
+        self.chunk_ms = chunk_ms
+        self.chunk_frames = chunk_frames_for(self.rate, chunk_ms)
+
+    def read(self):
+        raise NotImplementedError
+
+    def stop(self):
+        """Pausa: dejar de producir audio"""
+
+    def start(self):
+        """Reanudar tras stop()"""
+
+    def close(self):
+        """Liberar el dispositivo/fichero"""
+
+    def stats(self):
+        return f"Fuente {self.name}: {self.rate}Hz, {self.overruns} desbordes"
+
+
+class PyAudioSource(AudioSource):
+    """Micrófono por PyAudio (busca el USB SF-558 por nombre)
+
+    El stream va en modo callback: PortAudio entrega cada bloque desde su
+    hilo, el callback lo copia a un FrameRing preasignado y read() solo
+    espera a que haya un bloque (sin sondeo ni lecturas que bloqueen
+    dentro de ALSA). stop() despierta al lector con b''.
+    """
+
+    name = 'pyaudio'
+    DEVICE_HINTS = ('usb', 'sf', '558')
+    BUFFER_SECONDS = 2.0  # Audio que puede esperar a read() antes de perderse
+    STALL_SECONDS = 2.0   # Sin bloques con el stream activo: dispositivo caído
+
+    def __init__(self, target_rate=16000, hints=None, preferred=None):
+        super().__init__(rate=44100)
+        self.target_rate = target_rate
+        self.preferred = preferred  # Nombre exacto del último micro usado
+        self.device_name = None
+        # Con hints explícitos el micro es obligatorio (sin caer al default)
+        self.required = hints is not None
+        self.hints = tuple(hint.lower() for hint in hints) if hints else self.DEVICE_HINTS
+        self.audio = None
+        self.stream = None
+        self.ring = None
+        self.pending = 0  # Muestras del último read() aún sin liberar
+        self.active = False
+
+    def open(self, chunk_ms):
+        """Configura el micrófono USB SF-558 con conversión de frecuencia"""
+        # Import aquí: PyAudio (y PortAudio) tarda en cargar
+        import pyaudio
+        self.pyaudio = pyaudio
+        self.audio = pyaudio.PyAudio()
+        
+        # Buscar el último micro usado y, si no está, el USB SF-558
+        # (los índices cambian al reconectar: se buscan por nombre)
+        device_index = None
+        default_rate = 44100
+        inputs = [info for info in map(self.audio.get_device_info_by_index,
+                                       range(self.audio.get_device_count()))
+                  if info.get('maxInputChannels', 1) > 0]
+        found = [info for info in inputs if info.get('name') == self.preferred]
+        found = found or [info for info in inputs
+                          if any(hint in info.get('name', '').lower() for hint in self.hints)]
+        if found:
+            info = found[0]
+            device_index = info['index']
+            default_rate = int(info.get('defaultSampleRate', 44100))
+            self.device_name = info['name']
+            print(f"🎤 Micrófono USB: {info['name']}")
+            print(f"   Frecuencia nativa: {default_rate}Hz")
+        
+        if device_index is None and (self.required or self.strict):
+            self.audio.terminate()
+            self.audio = None
+            wanted = [self.preferred] if self.preferred else []
+            raise ValueError(f"no hay micrófono {' ni '.join(wanted + ['/'.join(self.hints)])}")
+        self.fallback = device_index is None
+        if self.fallback:
+            # Solo para esta vez: remember_device() no lo guarda
+            print("⚠️ Usando micrófono default")
+            info = self.audio.get_default_input_device_info()
+            device_index = info['index']
+            self.device_name = info.get('name')
+        
+        self.rate = default_rate
+        
+        # Si el micro soporta 16kHz, capturar directamente y no convertir
+        try:
+            if self.audio.is_format_supported(
+                self.target_rate,
+                input_device=device_index,
+                input_channels=1,
+                input_format=pyaudio.paInt16
+            ):
+                self.rate = self.target_rate
+                print(f"   Captura nativa a {self.target_rate}Hz (sin conversión)")
+        except ValueError:
+            pass
+        
+        # Abrir stream con frecuencia nativa del micrófono
+        try:
+            self.open_ring(chunk_ms)
+            self.stream = self.audio.open(
+                format=pyaudio.paInt16,
+                channels=1,
+                rate=self.rate,
+                input=True,
+                input_device_index=device_index,
+                frames_per_buffer=self.chunk_frames,
+                stream_callback=self.on_audio
+            )
+            print(f"✅ Stream abierto a {self.rate}Hz")
+        except Exception as e:
+            print(f"⚠️ Error: {e}, probando 48000Hz...")
+            self.rate = 48000
+            self.open_ring(chunk_ms)
+            self.stream = self.audio.open(
+                format=pyaudio.paInt16,
+                channels=1,
+                rate=self.rate,
+                input=True,
+                input_device_index=device_index,
+                frames_per_buffer=self.chunk_frames,
+                stream_callback=self.on_audio
+            )
+        self.latency = self.stream.get_input_latency()
+
+    def open_ring(self, chunk_ms):
+        """Tamaño de bloque y anillo para la frecuencia elegida (antes del stream)"""
+        super().open(chunk_ms)
+        self.ring = FrameRing(int(self.BUFFER_SECONDS * self.rate), self.chunk_frames)
+        self.pending = 0
+        self.active = True
+
+    def on_audio(self, data, frame_count, time_info, status):
+        """Callback de PortAudio (su hilo): copiar al anillo y avisar"""
+        # Desbordes de ALSA y audio que nadie leyó a tiempo (anillo lleno)
+        if status & self.pyaudio.paInputOverflow:
+            self.overruns += 1
+        samples = np.frombuffer(data, dtype=np.int16)
+        if self.ring.write(samples) < len(samples):
+            self.overruns += 1
+        return None, self.pyaudio.paContinue
+
+    def read(self):
+        """Siguiente bloque, como vista del anillo: vale hasta el próximo read()
+
+        b'' si el stream se paró y no queda nada.
+        """
+        ring = self.ring
+        ring.advance(self.pending)
+        self.pending = 0
+        if not ring.wait(self.chunk_frames, self.STALL_SECONDS, lambda: not self.active):
+            raise IOError(f"sin audio del micrófono en {self.STALL_SECONDS:.0f}s")
+        n = min(ring.available(), self.chunk_frames)
+        if not n:
+            return b''
+        self.pending = n
+        return ring.peek(n).data.cast('B')
+
+    def set_active(self, active):
+        self.active = active
+        if self.ring is None:
+            return
+        if active:
+            # Lo de antes de la pausa ya no vale (start() va en el hilo lector)
+            self.ring.clear()
+            self.pending = 0
+        self.ring.wake()
+
+    def stop(self):
+        # Tras stop_stream() PortAudio ya no llama al callback
+        self.stream.stop_stream()
+        self.set_active(False)
+
+    def start(self):
+        self.set_active(True)
+        self.stream.start_stream()
+
+    def close(self):
+        self.set_active(False)
+        # Detener y cerrar el stream de audio
+        try:
+            if self.stream:
+                self.stream.stop_stream()
+                self.stream.close()
+                self.stream = None
+                print("✅ Stream de audio cerrado")
+        except Exception as e:
+            print(f"⚠️ Error cerrando stream: {e}")
+        
+        # Terminar PyAudio
+        try:
+            if self.audio:
+                self.audio.terminate()
+                self.audio = None
+                print("✅ PyAudio terminado")
+        except Exception as e:
+            print(f"⚠️ Error terminando PyAudio: {e}")
+
+
+def read_audio_file(path, raw_rate=16000):
+    """Lee un WAV o PCM crudo (int16 mono) -> (bytes int16 mono, frecuencia)"""
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f"{path}: solo WAV de 16 bits")
+            rate = wav.getframerate()
+            channels = wav.getnchannels()
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        return samples.tobytes(), rate
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data[:len(data) // 2 * 2], raw_rate
+
+
+def iter_audio_file(path, block_seconds, raw_rate=16000):
+    """Como read_audio_file, pero por bloques: genera (bytes int16 mono, frecuencia)
+
+    La memoria no depende de la duración del fichero.
+    """
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f"{path}: solo WAV de 16 bits")
+            rate = wav.getframerate()
+            channels = wav.getnchannels()
+            frames = max(1, int(rate * block_seconds))
+            while True:
+                samples = np.frombuffer(wav.readframes(frames), dtype=np.int16)
+                if not len(samples):
+                    return
+                if channels > 1:
+                    samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+                yield samples.tobytes(), rate
+    with open(path, 'rb') as f:
+        size = 2 * max(1, int(raw_rate * block_seconds))
+        while True:
+            data = f.read(size)
+            if len(data) < 2:
+                return
+            yield data[:len(data) // 2 * 2], raw_rate
+
+
+class FileSource(AudioSource):
+    """WAV o PCM crudo; realtime=True lo entrega al ritmo de la grabación"""
+
+    name = 'file'
+
+    def __init__(self, path, raw_rate=16000, realtime=True):
+        self.path = path
+        self.pcm, rate = read_audio_file(path, raw_rate)
+        self.view = memoryview(self.pcm)  # Bloques sin copiar
+        super().__init__(rate)
+        self.realtime = realtime
+        self.offset = 0
+        self.started = None
+
+    def read(self):
+        chunk_bytes = self.chunk_frames * 2
+        if self.offset >= len(self.pcm):
+            return None
+        if self.realtime:
+            # El bloque "llega" cuando termina de grabarse
+            if self.started is None:
+                self.started = time.perf_counter() - self.offset / 2 / self.rate
+            delay = self.started + (self.offset + chunk_bytes) / 2 / self.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        data = self.view[self.offset:self.offset + chunk_bytes]
+        self.offset += chunk_bytes
+        return data
+
+    def stop(self):
+        # Al reanudar, el ritmo cuenta desde ese momento
+        self.started = None
+
+    @property
+    def duration(self):
+        return len(self.pcm) / 2 / self.rate
+
+
+class StreamSource(AudioSource):
+    """PCM crudo int16 mono desde un fichero abierto (p.ej. stdin)
+
+    ffmpeg -i ... -f s16le -ac 1 -ar 16000 - | python voice_typing.py --source stdin
+    """
+
+    name = 'stdin'
+
+    def __init__(self, stream, rate=16000):
+        super().__init__(rate)
+        self.stream = stream
+
+    def read(self):
+        data = self.stream.read(self.chunk_frames * 2)
+        return data or None
+
+
+class UnixSocketSource(AudioSource):
+    """PCM crudo int16 mono por un socket Unix (un cliente cada vez)
+
+    El proceso no abre ningún dispositivo: PipeWire, ffmpeg o un relay de
+    un headset remoto escriben el audio en el socket.
+    """
+
+    name = 'unix'
+
+    def __init__(self, path, rate=16000):
+        super().__init__(rate)
+        self.path = os.path.expanduser(path)
+        self.server = None
+        self.conn = None
+
+    def open(self, chunk_ms):
+        super().open(chunk_ms)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(1)
+        print(f"🔌 Esperando audio en {self.path} ({self.rate}Hz)")
+
+    def read(self):
+        if self.conn is None:
+            self.conn, _ = self.server.accept()
+            print("🔌 Cliente de audio conectado")
+        data = recv_exact(self.conn, self.chunk_frames * 2)
+        data = data[:len(data) // 2 * 2]  # Sin medias muestras al cortar
+        if not data:
+            print("🔌 Cliente de audio desconectado")
+            self.conn.close()
+            self.conn = None
+        return data
+
+    def close(self):
+        for sock in (self.conn, self.server):
+            if sock:
+                sock.close()
+        self.conn = self.server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def reopen_source(source, keep_trying, max_delay=10.0):
+    """Vuelve a abrir una fuente caída, con espera exponencial entre intentos
+
+    Cerrar y abrir de nuevo vuelve a enumerar los dispositivos, así un
+    micro desenchufado y vuelto a enchufar aparece aunque cambie de índice.
+    Mientras la espera crece solo vale el mismo micro (strict); el de
+    reserva se acepta cuando ya llegó a max_delay. Devuelve (segundos,
+    intentos), o None si keep_trying() deja de valer.
+    """
+    started = time.monotonic()
+    delay = 0.5
+    attempts = 0
+    while keep_trying():
+        source.close()
+        time.sleep(delay)
+        attempts += 1
+        source.strict = delay < max_delay
+        try:
+            source.open(source.chunk_ms)
+            source.strict = False
+            return time.monotonic() - started, attempts
         except Exception as e:
-            print(f"⚠️ Error cargando config: {e}, usando defaults")
-    return DEFAULT_CONFIG.copy()
+            delay = min(delay * 2, max_delay)
+            print(f"   Intento {attempts} fallido: {e} (siguiente en {delay:.1f}s)")
+    source.strict = False
+    return None
 
-def save_config(config):
-    """Guarda configuración del usuario"""
-    try:
-        with open(CONFIG_PATH, 'w') as f:
-            json.dump(config, f, indent=2)
-        print(f"💾 Configuración guardada: {CONFIG_PATH}")
-        return True
-    except Exception as e:
-        print(f"⚠️ Error guardando config: {e}")
-        return False
 
-from vosk import Model, KaldiRecognizer
-import pyaudio
+def recv_exact(conn, size):
+    """Lee size bytes del socket (menos si el otro extremo cierra)"""
+    buf = bytearray()
+    while len(buf) < size:
+        part = conn.recv(size - len(buf))
+        if not part:
+            break
+        buf.extend(part)
+    return bytes(buf)
+
+
+class DeviceChannel:
+    """Un dispositivo de MultiSource: su propio hilo de captura y conversión
+
+    El hilo escribe el audio ya a 16kHz en un FrameRing y la mezcla lee
+    bloques como vistas del anillo, sin colas de objetos ni concatenar.
+    """
+
+    BUFFER_SECONDS = 2.0
+    NOISE_SECONDS = 5.0  # Ventana del ruido de fondo (percentil 10 de los bloques)
+
+    def __init__(self, source, target_rate, chunk_frames):
+        self.source = source
+        self.name = getattr(source, 'label', source.name)
+        self.pipeline = AudioPipeline(source.rate, target_rate)
+        self.target_rate = target_rate
+        self.ring = FrameRing(int(self.BUFFER_SECONDS * target_rate), chunk_frames)
+        self.silence = np.zeros(chunk_frames, dtype=np.int16)
+        self.taken = 0           # Muestras del último take() aún sin liberar
+        self.last_write = time.monotonic()
+        self.active = threading.Event()
+        self.active.set()
+        self.running = True
+        self.finished = False
+        self.cpu = 0.0           # CPU del hilo de captura (lectura + conversión)
+        self.samples = 0         # Muestras a target_rate entregadas
+        self.waits = deque(maxlen=2000)  # Captura -> mezcla (s)
+        self.selected = 0        # Bloques en que fue el elegido
+        self.noise_floor = None  # RMS del ruido de fondo (percentil bajo reciente)
+        self.levels = deque(maxlen=max(1, int(self.NOISE_SECONDS * target_rate / chunk_frames)))
+        self.stalled = False     # El último take() fue silencio de relleno
+        self.recoveries = []     # Segundos que tardó cada reconexión
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while self.running:
+            if not self.active.is_set():
+                self.active.wait()  # close() también lo despierta
+                continue
+            try:
+                data = self.source.read()
+            except Exception as e:
+                print(f"🔌 {self.name} caído: {e}")
+                recovered = reopen_source(self.source, lambda: self.running)
+                if recovered:
+                    self.pipeline = AudioPipeline(self.source.rate, self.target_rate)
+                    self.recoveries.append(recovered[0])
+                    print(f"✅ {self.name} recuperado en {recovered[0]:.1f}s "
+                          f"({recovered[1]} intentos)")
+                continue
+            if data is None:
+                self.finished = True
+                self.ring.wake()
+                return
+            if data:
+                start = time.thread_time()
+                samples = self.pipeline.process(data)
+                if self.ring.write(samples) < len(samples):
+                    self.source.overruns += 1  # La mezcla no lee a tiempo
+                self.last_write = time.monotonic()
+                self.cpu += time.thread_time() - start
+
+    def take(self, n, timeout):
+        """n muestras a target_rate (vista del anillo hasta el próximo take())
+
+        None si la fuente se ha terminado.
+        """
+        self.ring.advance(self.taken)
+        self.taken = 0
+        self.stalled = False
+        if not self.ring.wait(n, timeout, lambda: self.finished):
+            # Dispositivo atrasado: silencio en este bloque
+            self.stalled = True
+            return self.silence[:n]
+        if self.ring.available() < n:
+            return None
+        self.waits.append(time.monotonic() - self.last_write)
+        self.taken = n
+        self.samples += n
+        return self.ring.peek(n)
+
+    def snr_db(self, rms):
+        """SNR del bloque frente al ruido de fondo de este micro
+
+        None si el bloque no es audio de verdad (relleno de take() o ceros
+        digitales): no se puntúa ni cuenta para el ruido de fondo.
+        """
+        if self.stalled or rms <= 0:
+            return None
+        # Percentil bajo de los últimos segundos: la voz no lo sube y un
+        # bloque raro deja de influir en cuanto sale de la ventana
+        self.levels.append(rms)
+        self.noise_floor = max(float(np.percentile(self.levels, 10)), 1.0)
+        return 20 * math.log10(max(rms, 1) / self.noise_floor)
+
+    def clear(self):
+        self.ring.clear()
+        self.taken = 0
+        self.pipeline.reset()
+
+    def stats(self):
+        seconds = self.samples / self.target_rate
+        wait = 1000 * sum(self.waits) / len(self.waits) if self.waits else 0.0
+        return (f"{self.name}: CPU {1000 * self.cpu / seconds if seconds else 0:.2f}ms "
+                f"por segundo de audio, latencia {1000 * self.source.latency + wait:.0f}ms, "
+                f"elegido {self.selected} bloques, {self.source.overruns} desbordes, "
+                f"{len(self.recoveries)} reconexiones")
+
+
+class MultiSource(AudioSource):
+    """Varias fuentes a la vez, cada una en su hilo
+
+    Cada dispositivo se convierte a 16kHz en su propio hilo (PortAudio y
+    NumPy sueltan el GIL, así que se reparten entre núcleos). En cada
+    bloque se queda el de mejor SNR (best, con histéresis para no saltar
+    de micro a mitad de palabra) o se mezclan todos (mix).
+    """
+
+    name = 'multi'
+    SWITCH_DB = 3.0  # Ventaja mínima para cambiar de micro
+
+    def __init__(self, sources, mode='best', target_rate=16000):
+        super().__init__(target_rate)
+        if mode not in ('best', 'mix'):
+            print(f"⚠️ audio_mix desconocido '{mode}', usando best")
+            mode = 'best'
+        self.sources = sources
+        self.mode = mode
+        self.channels = []
+        self.current = 0
+
+    def open(self, chunk_ms):
+        super().open(chunk_ms)
+        for source in self.sources:
+            try:
+                source.open(chunk_ms)
+            except Exception as e:
+                print(f"⚠️ No se pudo abrir {getattr(source, 'label', source.name)}: {e}")
+                continue
+            self.channels.append(DeviceChannel(source, self.rate, self.chunk_frames))
+        if not self.channels:
+            raise RuntimeError("ningún dispositivo de audio disponible")
+        self.latency = max(channel.source.latency for channel in self.channels)
+        # Mezcla y salida preasignadas: read() devuelve una vista de out
+        self.mix = np.zeros(self.chunk_frames, dtype=np.float32)
+        self.out = np.zeros(self.chunk_frames, dtype=np.int16)
+        print(f"🎙️ {len(self.channels)} dispositivos, modo {self.mode}")
+        for channel in self.channels:
+            channel.thread.start()
+
+    def read(self):
+        timeout = 2 * self.chunk_frames / self.rate
+        blocks = []
+        for channel in self.channels:
+            block = channel.take(self.chunk_frames, timeout)
+            if block is not None:
+                blocks.append((channel, block))
+        if not blocks:
+            return None
+        
+        if self.mode == 'mix':
+            # Solo los que dieron audio: el relleno de un micro atascado o
+            # recuperándose bajaría el nivel de la mezcla. La media de int16
+            # siempre cabe en int16: sin recortar
+            live = [(channel, block) for channel, block in blocks if not channel.stalled]
+            self.mix[:] = 0
+            for channel, block in live:
+                self.mix += block
+                channel.selected += 1
+            if live:
+                self.mix *= 1 / len(live)
+            self.out[:] = self.mix
+            return self.out.data.cast('B')
+        
+        # best: el de mejor SNR, pero solo se cambia con ventaja clara
+        snrs = [channel.snr_db(pcm_rms(block)) for channel, block in blocks]
+        snrs = [-math.inf if snr is None else snr for snr in snrs]
+        best = max(range(len(blocks)), key=lambda i: snrs[i])
+        current = next((i for i, (channel, _) in enumerate(blocks)
+                        if channel is self.channels[self.current]), None)
+        if current is None or snrs[best] > snrs[current] + self.SWITCH_DB:
+            current = best
+            self.current = self.channels.index(blocks[best][0])
+        channel, block = blocks[current]
+        channel.selected += 1
+        return block.data.cast('B')
+
+    def stop(self):
+        for channel in self.channels:
+            channel.active.clear()
+            channel.source.stop()
+
+    def start(self):
+        for channel in self.channels:
+            channel.clear()
+            channel.source.start()
+            channel.active.set()
+
+    def close(self):
+        for channel in self.channels:
+            channel.running = False
+            channel.active.set()
+        for channel in self.channels:
+            channel.source.close()
+
+    def stats(self):
+        lines = [f"Fuente multi ({self.mode}): {len(self.channels)} dispositivos"]
+        lines.extend(f"   {channel.stats()}" for channel in self.channels)
+        return '\n'.join(lines)
+
+
+def create_audio_source(config, target_rate=16000):
+    """Fuente de audio según "audio_source" de la config"""
+    spec = config.get('audio_source', 'pyaudio')
+    rate = config.get('audio_source_rate', 16000)
+    if spec == 'pyaudio':
+        return PyAudioSource(target_rate, preferred=config.get('audio_device'))
+    if spec.startswith('pyaudio:'):
+        return PyAudioSource(target_rate, hints=spec[8:].split(','))
+    if spec == 'multi':
+        sources = []
+        for device in config.get('audio_devices', []):
+            if ':' not in device and device != 'stdin':
+                device = f"pyaudio:{device}"
+            source = create_audio_source(dict(config, audio_source=device), target_rate)
+            source.label = device
+            sources.append(source)
+        if not sources:
+            raise ValueError("audio_source multi sin audio_devices")
+        return MultiSource(sources, config.get('audio_mix', 'best'), target_rate)
+    if spec == 'stdin':
+        return StreamSource(sys.stdin.buffer, rate)
+    if spec.startswith('file:'):
+        return FileSource(os.path.expanduser(spec[5:]), rate)
+    if spec.startswith('unix:'):
+        return UnixSocketSource(spec[5:], rate)
+    raise ValueError(f"Fuente de audio desconocida: {spec}")
+
+
+def benchmark_capture_buffers(streams=4, seconds=30, chunk=4096):
+    """Compara colas de objetos contra FrameRing en el camino de captura
+
+    Por cada flujo: bloque del callback -> lector -> conversión -> mezcla,
+    como en MultiSource. "cola" es el camino anterior (queue.Queue de
+    bytes y de arrays, concatenar y tobytes); "anillo" usa FrameRing y
+    vistas. Mide CPU, flujos en tiempo real que caben en un núcleo y la
+    memoria temporal que pide cada bloque (pico de tracemalloc). Los dos
+    caminos comparten AudioPipeline; ~8 KB por bloque son los bytes que
+    simulan la entrada de PortAudio.
+    """
+    import tracemalloc
+    rng = np.random.default_rng(0)
+    
+    def queue_path(rate, pcm):
+        pipeline = AudioPipeline(rate, 16000)
+        captured, converted = queue.Queue(), queue.Queue()
+        pending = np.zeros(0, dtype=np.int16)
+        n = chunk_frames_for(16000, 1000 * chunk / rate)
+        
+        def step(offset):
+            nonlocal pending
+            captured.put(pcm[offset:offset + 2 * chunk])
+            converted.put((pipeline.process(captured.get()), time.monotonic()))
+            samples, _ = converted.get()
+            pending = np.concatenate((pending, samples))
+            if len(pending) >= n:
+                block, pending = pending[:n], pending[n:]
+                block.tobytes()
+        return step
+    
+    def ring_path(rate, pcm):
+        pipeline = AudioPipeline(rate, 16000)
+        n = chunk_frames_for(16000, 1000 * chunk / rate)
+        captured = FrameRing(2 * rate, chunk)
+        converted = FrameRing(2 * 16000, n)
+        
+        def step(offset):
+            captured.write(np.frombuffer(pcm[offset:offset + 2 * chunk], dtype=np.int16))
+            converted.write(pipeline.process(captured.peek(chunk).data.cast('B')))
+            captured.advance(chunk)
+            if converted.available() >= n:
+                converted.peek(n).data.cast('B')
+                converted.advance(n)
+        return step
+    
+    print(f"⏱️ Buffers de captura: {streams} flujos x {seconds}s, bloques de {chunk} frames")
+    for rate in (16000, 44100):
+        signal = 3000 * np.sin(2 * np.pi * 220 * np.arange(rate * seconds) / rate)
+        pcm = (signal + rng.normal(0, 300, len(signal))).astype(np.int16).tobytes()
+        offsets = range(0, len(pcm) - 2 * chunk + 1, 2 * chunk)
+        blocks = len(offsets) * streams
+        print(f"   {rate}Hz -> 16000Hz:")
+        for name, make in (('cola', queue_path), ('anillo', ring_path)):
+            steps = [make(rate, pcm) for _ in range(streams)]
+            start = time.process_time()
+            for offset in offsets:
+                for step in steps:
+                    step(offset)
+            cpu = time.process_time() - start
+            
+            # Memoria temporal por bloque (otra pasada: tracemalloc frena)
+            steps = [make(rate, pcm) for _ in range(streams)]
+            transient = 0
+            tracemalloc.start()
+            for offset in offsets[:200]:
+                for step in steps:
+                    before = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    step(offset)
+                    transient += tracemalloc.get_traced_memory()[1] - before
+            tracemalloc.stop()
+            measured = min(len(offsets), 200) * streams
+            print(f"      {name:7} {1e6 * cpu / blocks:7.1f} µs/bloque, "
+                  f"{blocks / cpu:8.0f} bloques/s (~{seconds * streams / cpu:.0f} flujos "
+                  f"en tiempo real), {transient / measured / 1024:6.1f} KB temporales/bloque")
+
+
+class DictationEngine:
+    """Núcleo del dictado, sin ventana ni micrófono
+
+    Recibe audio int16 a la frecuencia de la fuente y hace el resto:
+    conversión a 16kHz, VAD, cola, Vosk, correcciones, comandos y salida.
+    Lo usan la app (Tk + PyAudio) y el banco de pruebas offline.
+    """
+    
+    def __init__(self, config, recognizer, input_rate, chunk_frames,
+                 input_latency=0.0, target_rate=16000, ui_state=None,
+                 grammar_recognizer=None):
+        self.config = config
+        self.recognizer = recognizer
+        # grammar_recognizer(gramática JSON) -> reconocedor del modo comando
+        self.grammar_recognizer = grammar_recognizer
+        self.command_recognizer = None
+        self.command_mode = False
+        self.command_deadline = 0.0
+        self.input_rate = input_rate
+        self.target_rate = target_rate
+        self.chunk_frames = chunk_frames
+        self.input_latency = input_latency
+        self.running = False
+        self.ui_state = ui_state or UIState()
+        self.apply_config()
+        
+        # Duración real del bloque (tras redondear a frames enteros)
+        self.capture_profile, _ = resolve_chunk_ms(config)
+        self.chunk_ms = chunk_frames * 1000 / input_rate
+        print(f"   Bloques de {chunk_frames} frames ({self.chunk_ms:.1f}ms, "
+              f"perfil {self.capture_profile})")
+        
+        # Conversión a 16kHz y AGC/limitador/puerta de ruido (Vosk requiere 16kHz)
+        self.pipeline = AudioPipeline(input_rate, target_rate,
+                                      create_conditioner(config, target_rate))
+        
+        # Puerta de voz: el silencio no llega al reconocedor
+        self.vad_enabled = config.get('vad_enabled', True)
+        self.vad = VoiceGate(
+            self.energy_threshold,
+            chunk_ms=self.chunk_ms,
+            hangover_ms=config.get('vad_hangover_ms', 400),
+            preroll_ms=config.get('vad_preroll_ms', 300)
+        )
+        
+        # Cola acotada: el retraso nunca pasa de queue_max_seconds
+        self.audio_queue = AudioQueue(
+            math.ceil(config.get('queue_max_seconds', 2.0) * 1000 / self.chunk_ms),
+            config.get('queue_policy', 'drop-oldest')
+        )
+        
+        # Métricas por etapa (se exportan si metrics_format está configurado)
+        self.metrics = Metrics()
+        # Latencia de entrada: la declara PortAudio, no se mide por bloque
+        self.metrics.set_gauge('input_latency_seconds', input_latency)
+        self.metrics_exporter = create_metrics_exporter(self.metrics, config)
+        self.last_audio_at = time.monotonic()
+        
+        # Diario de frases (lo escribe su propio hilo)
+        self.journal = create_journal(config)
+        
+        # Segunda pasada: el audio de cada frase va al modelo grande
+        self.second_pass = create_second_pass(config, self.on_second_pass)
+        self.utterance_audio = bytearray()
+        self.first_pass = {}  # Número de frase -> texto de la primera pasada
+        
+        # Hilo de salida: escribir no frena el reconocimiento
+        self.output = OutputWorker(
+            self.prepare_output,
+            correct=lambda text: self.corrections.apply(text),
+            on_done=self.flash_success,
+            metrics=self.metrics,
+            exporter=self.metrics_exporter,
+            patch_window=config.get('second_pass_window_s', 15)
+        )
+        
+        # Latencias captura -> reconocedor (últimos bloques)
+        self.capture_latency = deque(maxlen=2000)
+        
+        # Streaming: escribir las palabras estables sin esperar al final
+        self.streaming = config.get('streaming_typing', False)
+        self.stabilizer = PartialStabilizer(config.get('streaming_stable_partials', 3))
+        
+    def apply_config(self):
+        """Aplica la configuración cargada"""
+        self.energy_threshold = self.config.get('energy_threshold', 150)
+        self.volume_boost = self.config.get('volume_boost', 1.0)
+        self.pause_threshold = self.config.get('pause_threshold', 0.5)
+        self.enter_words = self.config.get('enter_words', DEFAULT_CONFIG['enter_words'])
+        self.corrections = CorrectionEngine(
+            self.config.get('corrections', DEFAULT_CONFIG['corrections'])
+        )
+        self.load_commands()
+        self.sink = create_output_sink(self.config)
+        set_output_sink(self.sink)
+        self.config_mtime = self.get_config_mtime()
+        
+    def load_commands(self):
+        """Registro de comandos y, si se puede, el reconocedor con su gramática"""
+        self.commands = build_command_registry(self.config)
+        self.command_words = [w.lower() for w in self.config.get(
+            'command_words', DEFAULT_CONFIG['command_words'])]
+        self.commands.add_exact('modo comando', self.command_words, self.enter_command_mode)
+        self.commands.add_prefix('busca en el diario', ["busca en el diario",
+                                                       "busca en el historial",
+                                                       "busca lo que dije"],
+                                 self.search_journal)
+        if self.grammar_recognizer is None:
+            return
+        # Mismo modelo, otro reconocedor: cambiar de modo no recarga nada
+        try:
+            self.command_recognizer = self.grammar_recognizer(json.dumps(
+                self.commands.grammar(), ensure_ascii=False))
+        except Exception as e:
+            print(f"⚠️ Sin modo comando (gramática): {e}")
+            self.command_recognizer = None
+        
+    def search_journal(self, query):
+        """Comando de voz: resultados del diario en un fichero de texto"""
+        if getattr(self, 'journal', None) is None:
+            print("⚠️ El diario está desactivado")
+            return
+        results = self.journal.search(query)
+        print(f"🔎 {len(results)} frases con '{query}'")
+        path = os.path.join(self.journal.path, 'busqueda.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Búsqueda: {query}\n\n")
+            f.writelines(format_journal_entry(entry) + '\n' for entry in results)
+        subprocess.Popen(['xdg-open', path])
+        
+    def log_result(self, text, result, command=None, revises=None):
+        """Añade la frase al diario (sin esperar al disco)
+
+        revises: texto de la primera pasada que esta frase corrige.
+        """
+        if self.journal is None or not text:
+            return
+        words = result.get('result', [])
+        entry = {'t': round(time.time(), 3), 'text': self.corrections.apply(text)}
+        if entry['text'] != text:
+            entry['raw'] = text
+        if words:
+            entry['words'] = [[w['word'], round(w['start'], 2), round(w['end'], 2),
+                               round(w.get('conf', 1.0), 3)] for w in words]
+            entry['conf'] = round(sum(w[3] for w in entry['words']) / len(words), 3)
+        entry['sink'] = self.sink.name
+        if command:
+            entry['cmd'] = command
+        if revises:
+            entry['revises'] = self.corrections.apply(revises)
+        self.journal.append(entry)
+        
+    def enter_command_mode(self):
+        """La siguiente frase va al reconocedor de comandos"""
+        if self.command_recognizer is None:
+            print("⚠️ Modo comando no disponible con este reconocedor")
+            return
+        self.command_deadline = time.monotonic() + self.config.get('command_timeout_s', 5)
+        self.command_mode = True
+        self.ui_state.command = True
+        # El hilo de reconocimiento duerme sin plazo: que tome el nuevo
+        self.audio_queue.wake()
+        print("🎯 Modo comando: di el comando")
+        
+    def request_command_mode(self):
+        """Atajo (clic central, SIGUSR1): modo comando tras cerrar la frase
+
+        Lo hace el hilo de reconocimiento al llegar al marcador, así el
+        audio ya encolado termina en el dictado y no en la gramática.
+        """
+        self.audio_queue.put(COMMAND_MODE)
+        
+    def exit_command_mode(self):
+        self.command_mode = False
+        self.ui_state.command = False
+        
+    def start(self):
+        """Arranca el hilo de reconocimiento"""
+        self.running = True
+        self.process_thread = threading.Thread(target=self.process_audio, daemon=True)
+        self.process_thread.start()
+        
+    def feed(self, data, captured_at=None):
+        """Entra un bloque de audio int16 de la fuente (bytes)"""
+        captured_at = captured_at or time.monotonic()
+        
+        # Conversión a 16kHz y acondicionamiento (volume_boost = ajuste fino)
+        samples = self.pipeline.process(data, self.volume_boost)
+        if not len(samples):
+            return  # La puerta espectral aún no tiene una ventana completa
+        # Única copia del bloque: el pipeline reutiliza su buffer y el preroll
+        # del VAD y la cola se quedan con el bloque (Vosk pide bytes)
+        data = samples.tobytes()
+        self.metrics.observe('resample', time.monotonic() - captured_at)
+        
+        if self.vad_enabled:
+            # Solo pasa la voz (más pre-roll y hangover). Con AGC el umbral
+            # se compara con el nivel antes de la ganancia automática
+            rms = self.pipeline.level if self.pipeline.conditioner else pcm_rms(samples)
+            for chunk in self.vad.process(data, rms):
+                # Pre-roll y hangover son silencio: se descartan antes
+                silent = chunk is not data or rms < self.vad.threshold
+                self.audio_queue.put(chunk, silent, captured_at)
+        else:
+            self.audio_queue.put(data, captured_at=captured_at)
+            
+    def end_of_speech(self):
+        """Cierra la frase en curso (pausa, fin de fichero...)"""
+        self.audio_queue.put(SPEECH_END)
+        
+    def reset_audio(self):
+        """Olvida el estado de audio (tras una discontinuidad)"""
+        self.vad.reset()
+        self.pipeline.reset()
+        
+    def reconfigure_input(self, input_rate, chunk_frames, input_latency=0.0):
+        """La fuente ha vuelto (quizá con otra frecuencia): rehacer la conversión"""
+        self.input_rate = input_rate
+        self.chunk_frames = chunk_frames
+        self.input_latency = input_latency
+        self.metrics.set_gauge('input_latency_seconds', input_latency)
+        self.chunk_ms = chunk_frames * 1000 / input_rate
+        self.pipeline = AudioPipeline(input_rate, self.target_rate,
+                                      create_conditioner(self.config, self.target_rate))
+        self.vad.reset()
+        
+    def drain(self):
+        """Espera a que todo el audio encolado esté reconocido y escrito"""
+        self.audio_queue.join()
+        self.output.queue.join()
+        
+    def get_config_mtime(self):
+        """Fecha de modificación del fichero de config (None si no existe)"""
+        try:
+            return os.path.getmtime(CONFIG_PATH)
+        except OSError:
+            return None
+            
+    def reload_corrections_if_changed(self):
+        """Recarga la tabla de correcciones si se editó el fichero de config"""
+        mtime = self.get_config_mtime()
+        if mtime == self.config_mtime:
+            return
+        self.config_mtime = mtime
+        corrections = load_config().get('corrections', DEFAULT_CONFIG['corrections'])
+        self.config['corrections'] = corrections
+        self.corrections = CorrectionEngine(corrections)
+        print(f"🔄 Correcciones recargadas: {len(self.corrections.table)} entradas")
+        
+    def process_audio(self):
+        """Procesa audio con Vosk y escribe el texto
+
+        Sin audio el hilo duerme en la cola (sin timeout); solo el modo
+        comando le pone un plazo. Termina cuando stop() cierra la cola.
+        """
+        while True:
+            timeout = None
+            if self.command_mode:
+                timeout = max(0.0, self.command_deadline - time.monotonic())
+            try:
+                data, captured_at = self.audio_queue.get(timeout)
+            except queue.Empty:
+                # Modo comando sin que se diga nada: volver al dictado
+                if self.command_mode and time.monotonic() >= self.command_deadline:
+                    print("⌛ Modo comando cancelado")
+                    self.exit_command_mode()
+                continue
+            if data is None:
+                return  # Cola cerrada y vacía
+            try:
+                self.process_chunk(data, captured_at)
+            except Exception as e:
+                print(f"⚠️ Error procesando: {e}")
+            finally:
+                self.audio_queue.task_done()
+                
+    def process_chunk(self, data, captured_at):
+        """Pasa un bloque de la cola por Vosk"""
+        received_at = time.monotonic()
+        
+        # Atajo de modo comando: la frase de dictado a medias se cierra
+        # (y se escribe) antes de pasar a la gramática
+        if data == COMMAND_MODE:
+            if not self.command_mode:
+                # Si la frase era la palabra de comando, handle_result ya entra
+                self.handle_result(self.recognizer.FinalResult(), received_at)
+            if not self.command_mode:
+                self.enter_command_mode()
+            return
+        
+        # Fin de voz según el VAD: cerrar la frase pendiente
+        if data == SPEECH_END:
+            if self.command_mode:
+                self.handle_command(self.command_recognizer.FinalResult(), received_at)
+            else:
+                self.handle_result(self.recognizer.FinalResult(), received_at)
+            return
+        
+        # Edad de la muestra más antigua del bloque al llegar a Vosk
+        self.capture_latency.append(
+            received_at - captured_at + self.chunk_ms / 1000 + self.input_latency
+        )
+        self.last_audio_at = captured_at
+        self.metrics.observe('queue_wait', received_at - captured_at)
+        self.metrics.set_gauge('queue_depth', self.audio_queue.size)
+        
+        if self.command_mode:
+            # Gramática cerrada: mucho menos trabajo que el dictado
+            is_final = self.command_recognizer.AcceptWaveform(data)
+            accept_time = time.monotonic() - received_at
+            self.metrics.observe('accept_command', accept_time)
+            if is_final:
+                self.handle_command(self.command_recognizer.Result(), received_at + accept_time)
+            return
+        
+        # Copia para la segunda pasada (hasta SECOND_PASS_MAX_SECONDS)
+        if (self.second_pass is not None
+                and len(self.utterance_audio) <= SECOND_PASS_MAX_SECONDS * 2 * self.target_rate):
+            self.utterance_audio += data
+        
+        # Enviar a Vosk
+        is_final = self.recognizer.AcceptWaveform(data)
+        accept_time = time.monotonic() - received_at
+        self.metrics.observe('accept', accept_time)
+        self.metrics.inc('chunks')
+        self.metrics.inc('audio_seconds', len(data) / 2 / self.target_rate)
+        self.metrics.inc('accept_seconds', accept_time)
+        
+        if is_final:
+            # Resultado final
+            self.handle_result(self.recognizer.Result(), received_at + accept_time)
+        else:
+            # Resultado parcial (feedback visual)
+            partial = json.loads(self.recognizer.PartialResult())
+            if partial.get('partial', ''):
+                # Amarillo = escuchando activamente
+                self.ui_state.status = 'speaking'
+                if self.streaming:
+                    words = self.stabilizer.update(partial['partial'])
+                    if words:
+                        self.output.submit_partial(words)
+                        
+    def handle_result(self, result_json, requested_at=None):
+        """Manda el texto de un resultado final de Vosk al hilo de salida"""
+        result = json.loads(result_json)
+        text = result.get('text', '').strip()
+        trace = {'text': text, 'audio_end': self.last_audio_at}
+        if requested_at is not None:
+            trace['result'] = time.monotonic() - requested_at
+            self.metrics.observe('result', trace['result'])
+        streamed = self.stabilizer.committed
+        self.stabilizer.reset()
+        self.ui_state.status = 'listening'
+        audio = bytes(self.utterance_audio)
+        self.utterance_audio.clear()
+        
+        # Palabra de modo comando: cambiar ya, sin pasar por la salida
+        if not streamed and text.lower() in self.command_words:
+            self.enter_command_mode()
+            return
+        
+        # Aunque el final venga vacío, hay que corregir lo ya escrito
+        if text or streamed:
+            print(f"🎤 {text}")
+            number = self.output.submit(text, trace)
+            self.log_result(text, result)
+            if text:
+                self.rescore(number, text, audio)
+            
+    def rescore(self, number, text, audio):
+        """Manda la frase escrita a la segunda pasada (los comandos no)"""
+        if self.second_pass is None or not audio:
+            return
+        if len(audio) > SECOND_PASS_MAX_SECONDS * 2 * self.target_rate:
+            return  # Frase demasiado larga: solo se guardó el principio
+        if self.commands.match(self.corrections.apply(text)) is not None:
+            return
+        self.first_pass[number] = text
+        if not self.second_pass.submit(number, audio):
+            del self.first_pass[number]
+            
+    def on_second_pass(self, number, result_json, seconds):
+        """Resultado del modelo grande (hilo del pool): corregir o anotar"""
+        first = self.first_pass.pop(number, None)
+        self.metrics.observe('second_pass', seconds)
+        result = json.loads(result_json)
+        text = result.get('text', '').strip()
+        if first is None or not text or text == first:
+            return
+        print(f"🔁 {first} -> {text}")
+        self.metrics.inc('second_pass_changed')
+        if self.config.get('second_pass_action', 'patch') == 'patch':
+            self.output.submit_patch(number, text)
+        self.log_result(text, result, revises=first)
+            
+    def handle_command(self, result_json, requested_at):
+        """Resultado del reconocedor de comandos: ejecutar y volver al dictado"""
+        self.exit_command_mode()
+        self.ui_state.status = 'listening'
+        result = json.loads(result_json)
+        text = ' '.join(w for w in result.get('text', '').split() if w != '[unk]')
+        self.metrics.observe('result_command', time.monotonic() - requested_at)
+        if not text or self.commands.match(text) is None:
+            print(f"❓ Comando no reconocido: {result.get('text', '')!r}")
+            return
+        print(f"🎯 {text}")
+        self.output.submit(text, {'text': text, 'audio_end': self.last_audio_at})
+        self.log_result(text, result, command=self.commands.match(text)[0])
+            
+    def prepare_output(self, text):
+        """Decide qué hacer con una frase: lista de acciones de salida
+
+        ('type', texto) escribe, ('keys', teclas) pulsa y ('call', f)
+        ejecuta un comando. Así el hilo de salida puede juntar varias
+        frases en una sola escritura.
+        """
+        try:
+            text_clean = text.lower().strip()
+            
+            # CORRECCIONES: tabla "corrections" de la config (una sola pasada)
+            self.reload_corrections_if_changed()
+            text = self.corrections.apply(text)
+            
+            # COMANDOS DE VOZ: una sola búsqueda en el registro
+            command = self.commands.match(text)
+            if command:
+                _, action = command
+                return [('call', action)]
+            
+            enter_keywords = get_enter_keywords(self.enter_words)
+            
+            # CASO 2: Palabra mágica al FINAL de la frase
+            # Buscar si termina con espacio + keyword (o variantes)
+            for keyword in enter_keywords:
+                # Patrón: " ... texto keyword" (con espacio antes)
+                if text_clean.endswith(f" {keyword}"):
+                    actions = []
+                    # Extraer todo antes del espacio + keyword
+                    text_to_write = text_clean[:-len(keyword)-1].strip()
+                    if text_to_write:
+                        # Restaurar mayúsculas del texto original
+                        original_text = text[:text.lower().rfind(f" {keyword}")].strip()
+                        if original_text and original_text[0] not in '.,;:!?':
+                            original_text = ' ' + original_text
+                        actions.append(('type', original_text))
+                    # Enviar Enter
+                    actions.append(('keys', ('return',)))
+                    print(f"📝 + ⏎ (detectado '{keyword}' al final)")
+                    return actions
+                
+                # También detectar si la palabra está pegada al final sin espacio
+                elif text_clean.endswith(keyword) and len(text_clean) > len(keyword):
+                    # Verificar que sea realmente el final y no parte de otra palabra
+                    prefix = text_clean[:-len(keyword)]
+                    # Lista de prefijos a evitar
+                    bad_prefixes = ['intr', 'sal', 'env', 'mand']
+                    if prefix and not any(prefix.endswith(bp) for bp in bad_prefixes):
+                        actions = []
+                        # Restaurar mayúsculas
+                        end_pos = len(text) - len(keyword)
+                        text_to_write = text[:end_pos].strip()
+                        if text_to_write:
+                            if text_to_write[0] not in '.,;:!?':
+                                text_to_write = ' ' + text_to_write
+                            actions.append(('type', text_to_write))
+                        actions.append(('keys', ('return',)))
+                        print(f"📝 + ⏎ (detectado '{keyword}' pegado)")
+                        return actions
+            
+            # CASO 4: Texto normal
+            # Añadir espacio si no empieza con puntuación
+            if text and text[0] not in '.,;:!?':
+                text = ' ' + text
+            # Escribir con espacio al final
+            return [('type', text + ' ')]
+        except Exception as e:
+            print(f"⚠️ Error preparando texto: {e}")
+            return []
+            
+    def flash_success(self):
+        """Flash verde cuando se escribe correctamente"""
+        self.ui_state.flash(0.1)
+        
+    def latency_report(self):
+        """Latencia medida captura -> reconocedor con el perfil actual"""
+        if not self.capture_latency:
+            return f"Latencia captura ({self.capture_profile}): sin datos"
+        samples = sorted(self.capture_latency)
+        mean = sum(samples) / len(samples)
+        p95 = samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+        return (f"Latencia captura->reconocedor ({self.capture_profile}, "
+                f"{self.chunk_ms:.0f}ms): media {1000 * mean:.0f}ms, p95 {1000 * p95:.0f}ms")
+        
+    def stop(self, report=True):
+        """Para el reconocimiento e imprime las estadísticas
+
+        Orden fijo: cerrar la frase en curso (FinalResult), vaciar la
+        cola, esperar al hilo de reconocimiento y luego al de salida. Así
+        la última frase se escribe aunque se cierre a mitad de hablar.
+        """
+        if self.running:
+            self.running = False
+            self.end_of_speech()
+            self.audio_queue.close()
+            if threading.current_thread() is not self.process_thread:
+                self.process_thread.join()
+        if self.second_pass is not None:
+            self.second_pass.close()
+        self.output.stop()
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        if self.journal:
+            self.journal.close()
+        if not report:
+            return
+        print(f"📊 {self.vad.stats()}")
+        print(f"📊 {self.audio_queue.stats()}")
+        print(f"📊 {self.sink.stats()}")
+        print(f"📊 {self.latency_report()}")
+        if self.second_pass is not None:
+            print(f"📊 {self.second_pass.stats()}, {self.output.patched} corregidas "
+                  f"en pantalla, {self.output.patches_skipped} sin tocar")
+        print(f"📊 {self.metrics.report()}")
+        
+        
+class StartupProfile:
+    """Tiempos de cada fase del arranque, desde que Python carga el script"""
+
+    def __init__(self, t0=STARTUP_T0):
+        self.t0 = t0
+        self.phases = []
+        self.lock = threading.Lock()
 
+    def add(self, name, start, end=None):
+        """Registra una fase (puede llamarse desde cualquier hilo)"""
+        end = time.perf_counter() if end is None else end
+        with self.lock:
+            self.phases.append((start, end, name))
 
-class VoiceTyperVosk:
+    def report(self):
+        print("⏱️ Arranque (ms desde el inicio del proceso):")
+        for start, end, name in sorted(self.phases, key=lambda phase: phase[1]):
+            print(f"   {name:<24} {1000 * (start - self.t0):7.0f} → "
+                  f"{1000 * (end - self.t0):7.0f}  ({1000 * (end - start):.0f}ms)")
+
+
+class VoiceTyperVosk(DictationEngine):
     """Aplicación de dictado por voz ultra-rápida usando Vosk"""
     
-    def __init__(self):
-        # Cargar configuración
-        self.config = load_config()
-        self.original_config = self.config.copy()  # Para comparar cambios
+    def __init__(self, overrides=None, startup_profile=False):
+        self.startup = StartupProfile()
+        self.startup.add('imports', STARTUP_T0, time.perf_counter())
+        self.show_startup_profile = startup_profile
+        
+        # Cargar configuración (+ opciones de línea de comandos)
+        started = time.perf_counter()
+        config = load_config()
+        config.update(overrides or {})
+        self.config = config
+        self.original_config = config.copy()  # Para comparar cambios
+        self.startup.add('config', started)
+        
+        if not config.get('recognizer_server') and not os.path.exists(MODEL_PATH):
+            print(f"❌ Modelo no encontrado en {MODEL_PATH}")
+            print("📥 Descarga: https://alphacephei.com/vosk/models")
+            sys.exit(1)
         
         # UI Setup - Ventana minimalista sin bordes
+        started = time.perf_counter()
         self.root = tk.Tk()
         self.root.title("🎤")
         self.root.geometry("85x60+50+50")
@@ -119,84 +3396,125 @@ class VoiceTyperVosk:
         self.root.overrideredirect(True)
         
         self.listening = True
-        self.audio_queue = queue.Queue()
+        self.listen_event = threading.Event()  # Set = escuchando
+        self.listen_event.set()
+        self.closing = False  # cleanup_and_exit() en marcha
         
-        # Cargar modelo Vosk español
-        print("🧠 Cargando modelo Vosk español...")
-        if not os.path.exists(MODEL_PATH):
-            print(f"❌ Modelo no encontrado en {MODEL_PATH}")
-            print("📥 Descarga: https://alphacephei.com/vosk/models")
-            sys.exit(1)
-        
-        self.model = Model(MODEL_PATH)
-        print("✅ Modelo cargado!")
-        
-        # Configurar micrófono USB SF-558
-        self.setup_audio()
-        
-        # Crear UI
+        # El indicador sale ya, en gris hasta que el modelo esté cargado
+        self.ready = False
+        self.startup_error = None
+        self.ui_state = UIState()
+        self.ui_state.status = 'loading'
         self.setup_ui()
+        self.root.update()
+        self.startup.add('ventana visible', started)
         
-        # Iniciar reconocimiento con Vosk (requiere 16kHz)
+        # Vosk requiere 16kHz
         self.target_rate = 16000
-        self.recognizer = KaldiRecognizer(self.model, self.target_rate)
-        self.recognizer.SetWords(True)
-        
-        # Iniciar hilos de audio
-        self.audio_thread = threading.Thread(target=self.capture_audio, daemon=True)
-        self.process_thread = threading.Thread(target=self.process_audio, daemon=True)
         
-        self.audio_thread.start()
-        self.process_thread.start()
-        
-        print("🎤 Escuchando... ¡Habla!")
-        
-    def setup_audio(self):
-        """Configura el micrófono USB SF-558 con conversión de frecuencia"""
-        self.audio = pyaudio.PyAudio()
+        # Audio capturado durante la carga (no se pierde)
+        self.startup_lock = threading.Lock()
+        self.startup_buffer = deque()
+        self.startup_buffer_max = config.get('startup_buffer_seconds', 30)
         
-        # Buscar dispositivo USB SF-558
-        device_index = None
-        default_rate = 44100
+        # Atajo global del modo comando: asignar en el escritorio
+        # "pkill -USR1 -f voice_typing.py" a una combinación de teclas
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.ready and self.request_command_mode())
         
-        for i in range(self.audio.get_device_count()):
-            info = self.audio.get_device_info_by_index(i)
-            name = info.get('name', '').lower()
-            if 'usb' in name or 'sf' in name or '558' in name:
-                device_index = i
-                default_rate = int(info.get('defaultSampleRate', 44100))
-                print(f"🎤 Micrófono USB: {info['name']}")
-                print(f"   Frecuencia nativa: {default_rate}Hz")
-                break
+        # Modelo y micrófono en segundo plano, en paralelo
+        self.loader_thread = threading.Thread(target=self.load_in_background, daemon=True)
+        self.loader_thread.start()
         
-        if device_index is None:
-            print("⚠️ Usando micrófono default")
-            device_index = self.audio.get_default_input_device_info()['index']
+    def load_in_background(self):
+        """Carga modelo y abre el micrófono a la vez; luego arranca el motor"""
+        server = self.config.get('recognizer_server')
+        model_thread = threading.Thread(target=self.load_model, daemon=True)
+        if not server:
+            model_thread.start()
+        try:
+            # Fuente de audio (micrófono USB SF-558 por defecto)
+            started = time.perf_counter()
+            self.source = create_audio_source(self.config, self.target_rate)
+            _, chunk_ms = resolve_chunk_ms(self.config)
+            self.source.open(chunk_ms)
+            self.remember_device()
+            self.startup.add('dispositivo de audio', started)
+            self.startup_buffer = deque(maxlen=max(1, int(
+                self.startup_buffer_max * self.source.rate / self.source.chunk_frames)))
+            
+            # Capturar ya: lo que se diga mientras carga el modelo se guarda
+            self.audio_thread = threading.Thread(target=self.capture_audio, daemon=True)
+            self.audio_thread.start()
+            
+            started = time.perf_counter()
+            if server:
+                # Cliente ligero: el modelo lo tiene el servidor compartido
+                recognizer = RemoteRecognizer(
+                    server, self.config.get('recognizer_timeout_s', 10.0))
+                grammar_recognizer = None  # El servidor solo hace dictado
+                print(f"🛰️ Reconocedor remoto: {server}")
+            else:
+                model_thread.join()
+                if self.model is None:
+                    raise RuntimeError("no se pudo cargar el modelo")
+                
+                # Iniciar reconocimiento con Vosk
+                started = time.perf_counter()
+                from vosk import KaldiRecognizer
+                recognizer = KaldiRecognizer(self.model, self.target_rate)
+                recognizer.SetWords(True)
+                grammar_recognizer = (
+                    lambda grammar: KaldiRecognizer(self.model, self.target_rate, grammar))
+            DictationEngine.__init__(
+                self, self.config, recognizer, self.source.rate, self.source.chunk_frames,
+                input_latency=self.source.latency, target_rate=self.target_rate,
+                ui_state=self.ui_state, grammar_recognizer=grammar_recognizer
+            )
+            self.start()
+            self.startup.add('motor de dictado', started)
+        except Exception as e:
+            print(f"❌ Error arrancando: {e}")
+            self.startup_error = e
+            return
         
-        self.input_rate = default_rate
+        # Pasar al motor el audio guardado y seguir en directo. La cola solo
+        # guarda unos segundos: mientras se vacía el búfer se espera a que
+        # Vosk haga sitio (política block) en vez de descartar. El lock solo
+        # se toma para sacar cada bloque, así la captura sigue guardando
+        # detrás lo que llega mientras tanto
+        buffered = 0
+        live_policy, self.audio_queue.policy = self.audio_queue.policy, 'block'
+        while True:
+            with self.startup_lock:
+                if not self.startup_buffer or self.closing:
+                    self.audio_queue.policy = live_policy
+                    self.ready = True
+                    break
+                data = self.startup_buffer.popleft()
+            self.feed(data)
+            buffered += 1
+        self.ui_state.status = 'listening'
+        self.startup.add('listo', STARTUP_T0)
+        if buffered:
+            print(f"📼 {buffered} bloques capturados durante la carga")
+        print("🎤 Escuchando... ¡Habla!")
+        if self.show_startup_profile:
+            self.startup.report()
         
-        # Abrir stream con frecuencia nativa del micrófono
+    def load_model(self):
+        """Carga el modelo Vosk (el import de vosk también cuenta)"""
+        self.model = None
+        started = time.perf_counter()
         try:
-            self.stream = self.audio.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=self.input_rate,
-                input=True,
-                input_device_index=device_index,
-                frames_per_buffer=4096
-            )
-            print(f"✅ Stream abierto a {self.input_rate}Hz")
+            from vosk import Model
+            self.startup.add('import vosk', started)
+            print("🧠 Cargando modelo Vosk español...")
+            started = time.perf_counter()
+            self.model = Model(MODEL_PATH)
+            self.startup.add('modelo Vosk', started)
+            print("✅ Modelo cargado!")
         except Exception as e:
-            print(f"⚠️ Error: {e}, probando 48000Hz...")
-            self.input_rate = 48000
-            self.stream = self.audio.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=self.input_rate,
-                input=True,
-                input_device_index=device_index,
-                frames_per_buffer=4096
-            )
+            print(f"❌ Error cargando modelo: {e}")
         
     def setup_ui(self):
         """Crea la UI minimalista tipo 'blob' flotante con botón de ajustes"""
@@ -245,14 +3563,24 @@ class VoiceTyperVosk:
         
         # Eventos
         self.canvas.bind('<Button-1>', self.on_click)
+        self.canvas.bind('<Button-2>', lambda e: self.ready and self.request_command_mode())
         self.canvas.tag_bind(self.settings_btn, '<Button-1>', lambda e: self.open_settings())
         self.canvas.tag_bind(self.close_btn, '<Button-1>', lambda e: self.cleanup_and_exit())
         
-        # Aplicar configuración cargada
-        self.energy_threshold = self.config.get('energy_threshold', 150)
-        self.volume_boost = self.config.get('volume_boost', 1.0)
-        self.pause_threshold = self.config.get('pause_threshold', 0.5)
-        self.enter_words = self.config.get('enter_words', DEFAULT_CONFIG['enter_words'])
+        # Refresco del indicador desde el hilo de Tk
+        self.drawn_color = None
+        self.poll_ui()
+        
+    def poll_ui(self):
+        """Redibuja el círculo si el estado cambió (único acceso a Tk)"""
+        if self.startup_error is not None:
+            self.cleanup_and_exit()
+            return
+        color = self.ui_state.color()
+        if color != self.drawn_color:
+            self.canvas.itemconfig('circle', fill=color)
+            self.drawn_color = color
+        self.root.after(UI_POLL_MS, self.poll_ui)
         
     def on_click(self, event):
         """Maneja clicks en el canvas"""
@@ -274,6 +3602,9 @@ class VoiceTyperVosk:
         if hasattr(self, 'settings_window') and self.settings_window.winfo_exists():
             self.settings_window.lift()
             return
+        if not self.ready:
+            print("⏳ Ajustes disponibles cuando termine de cargar el modelo")
+            return
             
         self.settings_window = tk.Toplevel(self.root)
         self.settings_window.title("⚙️ Ajustes")
@@ -506,6 +3837,7 @@ class VoiceTyperVosk:
     def on_sensitivity_change(self, value):
         """Cambia sensibilidad en tiempo real"""
         self.energy_threshold = int(value)
+        self.vad.threshold = self.energy_threshold
         self.config['energy_threshold'] = self.energy_threshold
         self.mark_config_modified()
         print(f"🎤 Sensibilidad: {self.energy_threshold}")
@@ -547,9 +3879,11 @@ class VoiceTyperVosk:
         """Vuelve a configuración por defecto"""
         self.config = DEFAULT_CONFIG.copy()
         self.energy_threshold = DEFAULT_CONFIG['energy_threshold']
+        self.vad.threshold = self.energy_threshold
         self.volume_boost = DEFAULT_CONFIG['volume_boost']
         self.pause_threshold = DEFAULT_CONFIG['pause_threshold']
         self.enter_words = DEFAULT_CONFIG['enter_words']
+        self.load_commands()
         
         # Actualizar UI
         self.sens_var.set(self.energy_threshold)
@@ -569,320 +3903,157 @@ class VoiceTyperVosk:
     def toggle(self):
         """Pausar o reanudar la escucha"""
         self.listening = not self.listening
+        self.ui_state.paused = not self.listening
         if self.listening:
-            self.canvas.itemconfig('circle', fill='#e74c3c')
+            self.listen_event.set()
             print("▶️ Reanudado")
         else:
-            self.canvas.itemconfig('circle', fill='#2ecc71')
+            self.listen_event.clear()
             print("⏸️ Pausado")
             
-    def capture_audio(self):
-        """Captura audio y convierte frecuencia para Vosk"""
-        while True:
-            if self.listening:
-                try:
-                    # Leer audio del micrófono
-                    data = self.stream.read(4096, exception_on_overflow=False)
-                    
-                    # Aplicar boost de volumen si está configurado
-                    if self.volume_boost > 1.0:
-                        data = audioop.mul(data, 2, self.volume_boost)
-                    
-                    # Convertir a 16kHz si es necesario (Vosk requiere 16kHz)
-                    if self.input_rate != self.target_rate:
-                        data, _ = audioop.ratecv(
-                            data, 2, 1, self.input_rate, self.target_rate, None
-                        )
-                    
-                    self.audio_queue.put(data)
-                except Exception as e:
-                    print(f"⚠️ Error captura: {e}")
+    def pause_capture(self):
+        """Detiene la fuente y duerme el hilo de captura hasta reanudar"""
+        try:
+            self.source.stop()
+        except Exception as e:
+            print(f"⚠️ Error parando stream: {e}")
+        with self.startup_lock:
+            if self.ready:
+                # Cerrar la frase en curso: el reconocedor queda limpio
+                self.end_of_speech()
             else:
-                # Descartar audio cuando pausado
-                try:
-                    self.audio_queue.get_nowait()
-                except queue.Empty:
-                    pass
-                    
-    def process_audio(self):
-        """Procesa audio con Vosk y escribe el texto"""
-        while True:
-            try:
-                data = self.audio_queue.get(timeout=0.1)
-                
-                # Enviar a Vosk
-                if self.recognizer.AcceptWaveform(data):
-                    # Resultado final
-                    result = json.loads(self.recognizer.Result())
-                    text = result.get('text', '').strip()
-                    
-                    if text:
-                        print(f"🎤 {text}")
-                        self.type_text(text)
-                        self.flash_success()
-                else:
-                    # Resultado parcial (feedback visual)
-                    partial = json.loads(self.recognizer.PartialResult())
-                    if partial.get('partial', ''):
-                        # Amarillo = escuchando activamente
-                        self.canvas.itemconfig('circle', fill='#f39c12')
-                        
-            except queue.Empty:
-                pass
-            except Exception as e:
-                print(f"⚠️ Error procesando: {e}")
-                
-    def type_text(self, text):
-        """Escribe el texto donde esté el cursor del sistema"""
+                self.startup_buffer.clear()
+        
+        # Bloqueado sin CPU ni lecturas de ALSA hasta que toggle() reanude
+        self.listen_event.wait()
+        if self.closing:
+            return
+        
+        # El audio anterior a la pausa no debe mezclarse con el nuevo
+        if self.ready:
+            self.reset_audio()
         try:
-            text_clean = text.lower().strip()
-            
-            # CORRECCION: Caracteres especiales en español
-            # Corregir palabras comunes sin tildes/ene
-            spanish_corrections = {
-                "senor": "señor",
-                "Senor": "Señor",
-                "SENOR": "SEÑOR",
-                "ano": "año",
-                "Ano": "Año",
-                "ANO": "AÑO",
-                "manana": "mañana",
-                "Manana": "Mañana",
-                "corazon": "corazón",
-                "Corazon": "Corazón",
-                "cancion": "canción",
-                "Cancion": "Canción",
-                "nacion": "nación",
-                "Nacion": "Nación",
-                "accion": "acción",
-                "Accion": "Acción",
-            }
-            
-            for wrong, correct in spanish_corrections.items():
-                text = text.replace(wrong, correct)
-            
-            # CORRECCION: Variantes de "Bichin" -> "Bichin" (mi nombre - sin acento para evitar problemas de codificacion)
-            # Reemplazo simple y directo para todas las variantes
-            text = text.replace("bitcoin", "Bichin")
-            text = text.replace("Bitcoin", "Bichin")
-            text = text.replace("BITCOIN", "Bichin")
-            text = text.replace("virgin", "Bichin")
-            text = text.replace("Virgin", "Bichin")
-            text = text.replace("VIRGIN", "Bichin")
-            text = text.replace("bichn", "Bichin")
-            text = text.replace("Bichn", "Bichin")
-            text = text.replace("BICHN", "Bichin")
-            text = text.replace("bici", "Bichin")
-            text = text.replace("Bici", "Bichin")
-            text = text.replace("BICI", "Bichin")
-            text = text.replace("jim", "Bichin")
-            text = text.replace("Jim", "Bichin")
-            text = text.replace("JIM", "Bichin")
-            text = text.replace("beach in", "Bichin")
-            text = text.replace("Beach in", "Bichin")
-            text = text.replace("begin", "Bichin")
-            text = text.replace("Begin", "Bichin")
-            text = text.replace("pitching", "Bichin")
-            text = text.replace("Pitching", "Bichin")
-            text = text.replace("beachin", "Bichin")
-            text = text.replace("Beachin", "Bichin")
-            text = text.replace("bichin", "Bichin")
-            text = text.replace("Bichin", "Bichin")  # Ya esta bien escrito
-            text = text.replace("biching", "Bichin")
-            text = text.replace("Biching", "Bichin")
-            text = text.replace("mi-jin", "Bichin")
-            text = text.replace("Mi-jin", "Bichin")
-            text = text.replace("mijin", "Bichin")
-            text = text.replace("Mijin", "Bichin")
-            text = text.replace("mijing", "Bichin")
-            text = text.replace("Mijing", "Bichin")
-            text = text.replace("beechin", "Bichin")
-            text = text.replace("Beechin", "Bichin")
-            text = text.replace("bechin", "Bichin")
-            text = text.replace("Bechin", "Bichin")
-            
-            # COMANDOS DE BORRADO
-            # "borra" / "borrar" -> Borra última palabra (Ctrl+Backspace)
-            if text_clean in ["borra", "borrar", "borra la palabra", "borrar palabra"]:
-                pyautogui.keyDown('ctrl')
-                pyautogui.keyDown('backspace')
-                pyautogui.keyUp('backspace')
-                pyautogui.keyUp('ctrl')
-                print("⌫ Última palabra borrada")
-                return
-            
-            # "borra todo" / "borrar todo" -> Borra todo (Ctrl+A + Delete)
-            if text_clean in ["borra todo", "borrar todo", "borra todo el texto", "borrar todo el texto"]:
-                pyautogui.keyDown('ctrl')
-                pyautogui.keyDown('a')
-                pyautogui.keyUp('a')
-                pyautogui.keyUp('ctrl')
-                pyautogui.keyDown('delete')
-                pyautogui.keyUp('delete')
-                print("🗑️ Todo el texto borrado")
-                return
-            
-            # COMANDOS DE SISTEMA EXPANSIBLES
-            # "abre firefox" / "abre el navegador" → Abre navegador por defecto
-            if text_clean.startswith("abre "):
-                app_name = text_clean[5:].strip().lower()
-                if app_name in ["firefox", "navegador", "el navegador", "chrome", "brave"]:
-                    import subprocess
-                    subprocess.Popen(['xdg-open', 'https://'])
-                    print("🌐 Navegador abierto")
-                    return
-                elif app_name in ["terminal", "consola", "konsole"]:
-                    import subprocess
-                    subprocess.Popen(['konsole'])
-                    print("💻 Terminal abierta")
-                    return
-                elif app_name in ["spotify", "música", "musica"]:
-                    import subprocess
-                    subprocess.Popen(['spotify'])
-                    print("🎵 Spotify abierto")
-                    return
-                elif app_name == "vscode":
-                    import subprocess
-                    subprocess.Popen(['code'])
-                    print("📝 VSCode abierto")
-                    return
-            
-            # "busca X" / "buscar X" → Busca en Google (usa navegador por defecto)
-            if text_clean.startswith(("busca ", "buscar ")):
-                query = text[text.lower().find(" ")+1:].strip()
-                if query:
-                    import urllib.parse
-                    search_url = f"https://www.google.com/search?q={urllib.parse.quote(query)}"
-                    import subprocess
-                    subprocess.Popen(['xdg-open', search_url])
-                    print(f"🔍 Buscando: {query}")
-                    return
+            self.source.start()
+        except Exception as e:
+            print(f"⚠️ Error reanudando stream: {e}")
             
-            # "noticias de X" / "noticias sobre X" → Busca noticias (navegador por defecto)
-            if text_clean.startswith(("noticias de ", "noticias sobre ", "noticias ")):
-                if text_clean.startswith("noticias de "):
-                    query = text[12:].strip()
-                elif text_clean.startswith("noticias sobre "):
-                    query = text[15:].strip()
-                else:
-                    query = text[9:].strip()
+    def remember_device(self):
+        """Guarda en la config el micro que funcionó (para la próxima vez)"""
+        if self.source.fallback:
+            return  # El micro por defecto no sustituye al guardado
+        name = getattr(self.source, 'device_name', None)
+        if name and name != self.config.get('audio_device'):
+            self.config['audio_device'] = name
+            self.original_config['audio_device'] = name
+            if self.config.get('auto_save', True):
+                save_config_value('audio_device', name)
                 
-                if query:
-                    import urllib.parse
-                    # Corregir "winona rider" si está mal transcrito
-                    query_clean = query.replace("winona rider", "winona ryder")
-                    news_url = f"https://news.google.com/search?q={urllib.parse.quote(query_clean)}&hl=es"
-                    import subprocess
-                    subprocess.Popen(['xdg-open', news_url])
-                    print(f"📰 Buscando noticias de: {query_clean}")
-                    return
-            
-            # "abre youtube" / "youtube" → Abre YouTube (navegador por defecto)
-            if text_clean in ["youtube", "abre youtube", "abrir youtube"]:
-                import subprocess
-                subprocess.Popen(['xdg-open', 'https://youtube.com'])
-                print("📺 YouTube abierto")
-                return
-            
-            # "clima" / "tiempo" / "qué tiempo hace" → Abre clima de Madrid
-            if text_clean in ["clima", "tiempo", "qué tiempo hace", "que tiempo hace"]:
-                import subprocess
-                subprocess.Popen(['xdg-open', 'https://www.google.com/search?q=tiempo+madrid'])
-                print("🌤️ Consultando clima de Madrid")
-                return
-            
-            # Detectar palabras mágicas para enviar Enter
-            # "intro", "dentro", "adentro", "entro", "entra" son intercambiables
-            enter_keywords = ["intro", "enter", "salto", "enviar", "manda", "dentro"]
-            # También detectar variantes fonéticas
-            enter_variants = ["intro", "entro", "dentro", "adentro", "in tro", "en tro", "entra"]
-            if hasattr(self, 'enter_words'):
-                enter_keywords = self.enter_words
-                if "dentro" not in enter_keywords:
-                    enter_keywords.append("dentro")
-            
-            # CASO 1: Solo la palabra mágica (aislada) - AHORA SÍ FUNCIONA
-            if text_clean in enter_keywords or text_clean in enter_variants:
-                pyautogui.keyDown('return')
-                pyautogui.keyUp('return')
-                print(f"⏎ Enter enviado (solo '{text_clean}')")
-                return
-            
-            # CASO 2: Palabra mágica al FINAL de la frase
-            # Buscar si termina con espacio + keyword (o variantes)
-            all_keywords = list(set(enter_keywords + enter_variants))
-            
-            for keyword in all_keywords:
-                # Patrón: " ... texto keyword" (con espacio antes)
-                if text_clean.endswith(f" {keyword}"):
-                    # Extraer todo antes del espacio + keyword
-                    text_to_write = text_clean[:-len(keyword)-1].strip()
-                    if text_to_write:
-                        # Restaurar mayúsculas del texto original
-                        original_text = text[:text.lower().rfind(f" {keyword}")].strip()
-                        if original_text and original_text[0] not in '.,;:!?':
-                            original_text = ' ' + original_text
-                        pyautogui.typewrite(original_text, interval=0.01)
-                    # Enviar Enter
-                    pyautogui.keyDown('return')
-                    pyautogui.keyUp('return')
-                    print(f"📝 + ⏎ (detectado '{keyword}' al final)")
+    def recover_source(self, error):
+        """Micro caído: reabrir con espera creciente, sin recargar el modelo"""
+        print(f"🔌 Fuente de audio caída: {error}")
+        self.ui_state.status = 'loading'
+        with self.startup_lock:
+            if self.ready:
+                # Cerrar la frase en curso: el reconocedor empieza de cero
+                self.end_of_speech()
+            else:
+                self.startup_buffer.clear()
+        recovered = reopen_source(self.source,
+                                  lambda: self.listen_event.is_set() and not self.closing,
+                                  self.config.get('audio_retry_max_s', 10))
+        if recovered is None:
+            return  # Pausa o cierre durante los reintentos
+        seconds, attempts = recovered
+        self.remember_device()
+        if self.ready:
+            self.reconfigure_input(self.source.rate, self.source.chunk_frames,
+                                   self.source.latency)
+            self.metrics.observe('recovery', seconds)
+            self.metrics.inc('recoveries')
+        self.ui_state.status = 'listening'
+        print(f"✅ Audio recuperado en {seconds:.1f}s ({attempts} intentos, "
+              f"{self.source.rate}Hz)")
+        
+    def capture_audio(self):
+        """Lee la fuente de audio y la pasa al pipeline
+
+        Con PyAudio el hilo solo despierta cuando el callback entrega un
+        bloque. Al cerrar, la fuente ya parada devuelve lo que quedaba y
+        luego b'': entonces el hilo termina.
+        """
+        while True:
+            if not self.listen_event.is_set() and not self.closing:
+                self.pause_capture()
+                continue
+            try:
+                data = self.source.read()
+            except Exception as e:
+                if self.closing or not self.listen_event.is_set():
+                    if self.closing:
+                        return
+                    continue  # Pausa: el stream se paró a propósito
+                # Dispositivo desenchufado o stream muerto: no reintentar en bucle
+                self.recover_source(e)
+                continue
+            try:
+                if data is None:
+                    print(f"🔚 Fin del audio ({self.source.name})")
+                    if self.ready:
+                        self.end_of_speech()
                     return
-                
-                # También detectar si la palabra está pegada al final sin espacio
-                elif text_clean.endswith(keyword) and len(text_clean) > len(keyword):
-                    # Verificar que sea realmente el final y no parte de otra palabra
-                    prefix = text_clean[:-len(keyword)]
-                    # Lista de prefijos a evitar
-                    bad_prefixes = ['intr', 'sal', 'env', 'mand']
-                    if prefix and not any(prefix.endswith(bp) for bp in bad_prefixes):
-                        # Restaurar mayúsculas
-                        end_pos = len(text) - len(keyword)
-                        text_to_write = text[:end_pos].strip()
-                        if text_to_write:
-                            if text_to_write[0] not in '.,;:!?':
-                                text_to_write = ' ' + text_to_write
-                            pyautogui.typewrite(text_to_write, interval=0.01)
-                        pyautogui.keyDown('return')
-                        pyautogui.keyUp('return')
-                        print(f"📝 + ⏎ (detectado '{keyword}' pegado)")
+                if not data:
+                    if self.closing:
                         return
-            
-            # CASO 4: Texto normal
-            # Añadir espacio si no empieza con puntuación
-            if text and text[0] not in '.,;:!?':
-                text = ' ' + text
-            # Escribir con espacio al final
-            pyautogui.typewrite(text + ' ', interval=0.01)
-        except Exception as e:
-            print(f"⚠️ Error escribiendo: {e}")
-            
-    def flash_success(self):
-        """Flash verde cuando se escribe correctamente"""
-        self.canvas.itemconfig('circle', fill='#2ecc71')
-        self.root.after(100, lambda: self.canvas.itemconfig('circle', fill='#e74c3c'))
+                    continue
+                if not self.ready:
+                    with self.startup_lock:
+                        if not self.ready:
+                            # Modelo aún cargando: guardar una copia para después
+                            self.startup_buffer.append(bytes(data))
+                            continue
+                self.feed(data)
+            except Exception as e:
+                print(f"⚠️ Error captura: {e}")
+                    
+    def shutdown(self):
+        """Para todo en orden: fuente, captura, última frase, salida
+
+        1. La fuente deja de producir (PortAudio ya no llama al callback).
+        2. El hilo de captura pasa lo que quedaba y termina.
+        3. stop() cierra la frase con FinalResult y espera a que se escriba.
+        4. Se libera el dispositivo.
+        """
+        if self.closing:
+            return
+        self.closing = True
+        self.listening = False
+        source = getattr(self, 'source', None)
+        if source is not None:
+            try:
+                source.stop()
+            except Exception as e:
+                print(f"⚠️ Error parando stream: {e}")
+        self.listen_event.set()  # Despertar a la captura si estaba en pausa
+        audio_thread = getattr(self, 'audio_thread', None)
+        if audio_thread is not None:
+            # stdin o un socket pueden seguir bloqueados: no esperar siempre
+            audio_thread.join(timeout=1.0)
+        if self.ready:
+            self.stop()
+            if isinstance(self.recognizer, RemoteRecognizer):
+                self.recognizer.close()
+        elif getattr(self, 'audio_queue', None) is not None:
+            self.audio_queue.close()  # Despierta al volcado del audio de la carga
+        
+        # Cerrar la fuente de audio (stream y PyAudio)
+        if source is not None:
+            print(f"📊 {source.stats()}")
+            source.close()
         
     def cleanup_and_exit(self):
         """Cierra la aplicación limpiamente liberando recursos"""
         print("🛑 Cerrando Voice Typing...")
-        self.listening = False
-        
-        # Detener y cerrar el stream de audio
-        try:
-            if hasattr(self, 'stream') and self.stream:
-                self.stream.stop_stream()
-                self.stream.close()
-                print("✅ Stream de audio cerrado")
-        except Exception as e:
-            print(f"⚠️ Error cerrando stream: {e}")
-        
-        # Terminar PyAudio
-        try:
-            if hasattr(self, 'audio') and self.audio:
-                self.audio.terminate()
-                print("✅ PyAudio terminado")
-        except Exception as e:
-            print(f"⚠️ Error terminando PyAudio: {e}")
+        self.shutdown()
         
         # Cerrar la ventana
         self.root.destroy()
@@ -891,13 +4062,822 @@ class VoiceTyperVosk:
     def run(self):
         """Inicia la aplicación"""
         self.root.mainloop()
-        # Limpieza al cerrar
-        self.stream.stop_stream()
-        self.stream.close()
-        self.audio.terminate()
+        # Ventana cerrada por otro camino: misma limpieza
+        self.shutdown()
+
+
+# === BANCO DE PRUEBAS OFFLINE ===
+class StubRecognizer:
+    """Reconocedor falso con la API de KaldiRecognizer (sin modelo)
+
+    Cierra una frase cada utterance_seconds de audio y "reconoce" una
+    palabra por cada word_seconds. Sirve para medir el coste del pipeline
+    sin el de Vosk.
+    """
+
+    def __init__(self, rate=16000, word_seconds=0.4, utterance_seconds=3.0):
+        self.rate = rate
+        self.word_seconds = word_seconds
+        self.utterance_seconds = utterance_seconds
+        self.seconds = 0.0
+
+    def SetWords(self, enabled):
+        pass
+
+    def AcceptWaveform(self, data):
+        self.seconds += len(data) / 2 / self.rate
+        return self.seconds >= self.utterance_seconds
+
+    def _text(self):
+        return ' '.join(['palabra'] * int(self.seconds / self.word_seconds))
+
+    def PartialResult(self):
+        return json.dumps({'partial': self._text()})
+
+    def Result(self):
+        text = self._text()
+        self.seconds = 0.0
+        return json.dumps({'text': text})
+
+    FinalResult = Result
+
+
+def expand_audio_paths(paths):
+    """Ficheros de audio de una lista de rutas, directorios o globs"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for ext in ('*.wav', '*.raw', '*.pcm'):
+                found.extend(glob.glob(os.path.join(path, ext)))
+        elif any(char in path for char in '*?['):
+            found.extend(glob.glob(path))
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def normalize_words(text):
+    """Palabras en minúscula sin puntuación (para el WER)"""
+    return re.findall(r"\w+", text.lower())
+
+
+def word_error_rate(reference, hypothesis):
+    """WER: (sustituciones + borrados + inserciones) / palabras de referencia"""
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def find_reference(path, refs_dir=None):
+    """Transcripción de referencia: <nombre>.txt junto al audio o en refs_dir"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for candidate in ([os.path.join(refs_dir, stem + '.txt')] if refs_dir else []) + \
+            [os.path.splitext(path)[0] + '.txt']:
+        if os.path.exists(candidate):
+            with open(candidate, encoding='utf-8') as f:
+                return f.read()
+    return None
+
+
+def replay_file(path, config, model=None, realtime=False, raw_rate=16000, refs_dir=None):
+    """Pasa un fichero por el mismo pipeline que el micrófono, con salida nula"""
+    source = FileSource(path, raw_rate, realtime=realtime)
+    if model is None:
+        recognizer = StubRecognizer(16000)
+    else:
+        from vosk import KaldiRecognizer
+        recognizer = KaldiRecognizer(model, 16000)
+        recognizer.SetWords(True)
+    
+    _, chunk_ms = resolve_chunk_ms(config)
+    source.open(chunk_ms)
+    audio_seconds = source.duration
+    
+    engine = DictationEngine(config, recognizer, source.rate, source.chunk_frames)
+    engine.start()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    while True:
+        data = source.read()
+        if data is None:
+            break
+        engine.feed(data)
+    engine.end_of_speech()
+    engine.drain()
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    engine.stop(report=False)
+    
+    snap = engine.metrics.snapshot()
+    utterance = snap['stages'].get('utterance', {})
+    hypothesis = engine.sink.text()
+    reference = find_reference(path, refs_dir)
+    return {
+        'file': path,
+        'audio_seconds': audio_seconds,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'speed': audio_seconds / wall if wall else 0.0,
+        'real_time_factor': snap['real_time_factor'],
+        'utterances': snap['counters'].get('utterances', 0),
+        'latency_p50': utterance.get('p50'),
+        'latency_p95': utterance.get('p95'),
+        'vad_dropped_frames': engine.vad.frames_dropped,
+        'text': hypothesis.strip(),
+        'wer': word_error_rate(reference, hypothesis) if reference is not None else None,
+    }
+
+
+def run_replay(paths, stub=False, realtime=False, model_path=MODEL_PATH, raw_rate=16000,
+               refs_dir=None, json_path=None, overrides=None):
+    """Banco de pruebas sin micrófono ni pantalla: WAV/PCM -> Vosk -> salida nula"""
+    files = expand_audio_paths(paths)
+    if not files:
+        print("❌ No hay ficheros de audio")
+        return []
+    
+    config = load_config()
+    config.update(overrides or {})
+    config.update({'output_sink': 'null', 'metrics_format': None, 'journal_enabled': False,
+                   'second_pass_model': None})
+    if not realtime:
+        # Más rápido que tiempo real: la captura espera al reconocedor
+        config['queue_policy'] = 'block'
+    model = None
+    if not stub:
+        print(f"🧠 Cargando modelo: {model_path}")
+        from vosk import Model
+        model = Model(model_path)
+    
+    results = []
+    for path in files:
+        result = replay_file(path, config, model, realtime, raw_rate, refs_dir)
+        results.append(result)
+        latency = (f"{1000 * result['latency_p50']:.0f}/{1000 * result['latency_p95']:.0f}ms"
+                   if result['latency_p50'] is not None else "-")
+        wer = f"{100 * result['wer']:.1f}%" if result['wer'] is not None else "-"
+        print(f"🎧 {os.path.basename(path)}: {result['audio_seconds']:.1f}s audio, "
+              f"x{result['speed']:.1f} tiempo real, RTF {result['real_time_factor']:.3f}, "
+              f"{result['utterances']} frases, latencia p50/p95 {latency}, WER {wer}")
+    
+    audio = sum(r['audio_seconds'] for r in results)
+    wall = sum(r['wall_seconds'] for r in results)
+    cpu = sum(r['cpu_seconds'] for r in results)
+    scored = [r for r in results if r['wer'] is not None]
+    print(f"📊 Total: {audio:.1f}s audio en {wall:.1f}s (x{audio / wall if wall else 0:.1f}), "
+          f"CPU {1000 * cpu / audio if audio else 0:.1f}ms por segundo de audio"
+          + (f", WER medio {100 * sum(r['wer'] for r in scored) / len(scored):.1f}%"
+             if scored else ""))
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return results
+
+
+CONDITIONING_VARIANTS = {
+    'sin acondicionar': {'agc_enabled': False, 'spectral_gate': False},
+    'agc': {'agc_enabled': True, 'spectral_gate': False},
+    'agc + puerta': {'agc_enabled': True, 'spectral_gate': True},
+}
+
+
+def benchmark_conditioning(paths=None, stub=False, model_path=MODEL_PATH, raw_rate=16000,
+                           refs_dir=None, seconds=30, chunk_ms=90):
+    """CPU por segundo de audio del acondicionamiento y WER antes/después"""
+    rate = 16000
+    rng = np.random.default_rng(0)
+    t = np.arange(rate * seconds) / rate
+    # Voz sintética a ratos (200Hz modulada) sobre ruido de ventilador
+    speech = 800 * np.sin(2 * np.pi * 200 * t) * ((t * 2) % 1 < 0.6)
+    signal = (speech + rng.normal(0, 60, len(t))).astype(np.float32)
+    block = chunk_frames_for(rate, chunk_ms)
+    
+    print(f"⏱️ Acondicionamiento: {seconds}s de audio a {rate}Hz, bloques de {chunk_ms}ms")
+    for name, options in CONDITIONING_VARIANTS.items():
+        conditioner = create_conditioner(options, rate)
+        if conditioner is None:
+            continue
+        start = time.process_time()
+        for i in range(0, len(signal), block):
+            conditioner.process(signal[i:i + block])
+        cpu = time.process_time() - start
+        print(f"   {name:<16} {1000 * cpu / seconds:.3f} ms CPU por segundo de audio "
+              f"({100 * cpu / seconds:.2f}% de un núcleo)")
+    
+    files = expand_audio_paths(paths or [])
+    if not files:
+        return
+    model = None
+    if not stub:
+        print(f"🧠 Cargando modelo: {model_path}")
+        from vosk import Model
+        model = Model(model_path)
+    print(f"🎧 WER en {len(files)} ficheros:")
+    for name, options in CONDITIONING_VARIANTS.items():
+        config = load_config()
+        config.update(options)
+        config.update({'output_sink': 'null', 'metrics_format': None, 'journal_enabled': False,
+                       'second_pass_model': None, 'queue_policy': 'block'})
+        results = [replay_file(path, config, model, False, raw_rate, refs_dir) for path in files]
+        scored = [r['wer'] for r in results if r['wer'] is not None]
+        wer = f"{100 * sum(scored) / len(scored):.1f}%" if scored else "- (sin referencias)"
+        print(f"   {name:<16} WER medio {wer}, {sum(r['utterances'] for r in results)} frases")
+
+
+# === TRANSCRIPCIÓN POR LOTES ===
+BATCH_CHUNK_SECONDS = 2.0  # Audio por llamada a AcceptWaveform (sin tiempo real)
+
+# Estado de cada proceso del pool (un modelo por proceso)
+_batch_worker = {}
+
+
+def batch_worker_init(model_path, corrections, stub):
+    """Inicializa un proceso del pool: carga su propio modelo una sola vez"""
+    if stub:
+        _batch_worker['model'] = None
+    else:
+        from vosk import Model
+        _batch_worker['model'] = Model(model_path)
+    _batch_worker['corrections'] = CorrectionEngine(corrections)
+
+
+def transcribe_segment(result_json, corrections):
+    """Resultado de Vosk -> segmento con texto corregido, palabras y confianza"""
+    result = json.loads(result_json)
+    text = result.get('text', '')
+    if not text:
+        return None
+    words = [
+        {'word': w['word'], 'start': round(w['start'], 3),
+         'end': round(w['end'], 3), 'conf': round(w['conf'], 3)}
+        for w in result.get('result', [])
+    ]
+    segment = {'text': corrections.apply(text), 'raw': text, 'words': words}
+    if words:
+        segment['start'] = words[0]['start']
+        segment['end'] = words[-1]['end']
+        segment['confidence'] = round(sum(w['conf'] for w in words) / len(words), 3)
+    return segment
+
+
+def transcribe_file(args):
+    """Transcribe un fichero entero en el proceso actual -> dict para JSONL
+
+    El fichero se lee y se convierte por bloques de BATCH_CHUNK_SECONDS:
+    una grabación de horas ocupa lo mismo que una de segundos.
+    """
+    path, raw_rate = args
+    start = time.perf_counter()
+    model = _batch_worker['model']
+    if model is None:
+        recognizer = StubRecognizer(16000)
+    else:
+        from vosk import KaldiRecognizer
+        recognizer = KaldiRecognizer(model, 16000)
+        recognizer.SetWords(True)
+    corrections = _batch_worker['corrections']
+    
+    segments = []
+    pipeline = None
+    duration = 0.0
+    try:
+        for pcm, rate in iter_audio_file(path, BATCH_CHUNK_SECONDS, raw_rate):
+            if pipeline is None:
+                pipeline = AudioPipeline(rate, 16000)
+            duration += len(pcm) / 2 / rate
+            if recognizer.AcceptWaveform(pipeline.process(pcm).tobytes()):
+                segments.append(transcribe_segment(recognizer.Result(), corrections))
+    except (OSError, ValueError, EOFError, wave.Error) as e:
+        return {'file': path, 'error': str(e)}
+    segments.append(transcribe_segment(recognizer.FinalResult(), corrections))
+    segments = [seg for seg in segments if seg]
+    
+    confidences = [seg['confidence'] for seg in segments if 'confidence' in seg]
+    return {
+        'file': path,
+        'duration': round(duration, 3),
+        'text': ' '.join(seg['text'] for seg in segments),
+        'confidence': round(sum(confidences) / len(confidences), 3) if confidences else None,
+        'segments': segments,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def run_batch(paths, workers=None, output=None, stub=False, model_path=MODEL_PATH,
+              raw_rate=16000):
+    """Transcribe ficheros en paralelo y escribe una línea JSONL por fichero"""
+    files = expand_audio_paths(paths)
+    if not files:
+        print("❌ No hay ficheros de audio", file=sys.stderr)
+        return 0
+    if not stub and not os.path.exists(model_path):
+        print(f"❌ Modelo no encontrado en {model_path}", file=sys.stderr)
+        return 0
+    
+    # Los más largos primero: el último fichero no deja a los demás esperando
+    files.sort(key=lambda path: os.path.getsize(path) if os.path.exists(path) else 0,
+               reverse=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(files)))
+    config = load_config()
+    print(f"📼 {len(files)} ficheros, {workers} procesos (un modelo por proceso)",
+          file=sys.stderr)
+    
+    out = open(output, 'w', encoding='utf-8') if output else sys.stdout
+    done = 0
+    audio = 0.0
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(
+            workers, initializer=batch_worker_init,
+            initargs=(model_path, config.get('corrections', {}), stub)
+        ) as pool:
+            # Cada resultado se escribe en cuanto llega, sin esperar al resto
+            for result in pool.imap_unordered(transcribe_file,
+                                              [(path, raw_rate) for path in files]):
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+                done += 1
+                if 'error' in result:
+                    print(f"⚠️ {result['file']}: {result['error']}", file=sys.stderr)
+                    continue
+                audio += result['duration']
+                print(f"📝 [{done}/{len(files)}] {os.path.basename(result['file'])}: "
+                      f"{result['duration']:.1f}s en {result['seconds']:.1f}s",
+                      file=sys.stderr)
+    finally:
+        if output:
+            out.close()
+    
+    wall = time.perf_counter() - start
+    print(f"📊 Total: {audio:.1f}s de audio en {wall:.1f}s "
+          f"(x{audio / wall if wall else 0:.1f} tiempo real, {workers} procesos)",
+          file=sys.stderr)
+    return done
+
+
+# === SEGUNDA PASADA ===
+SECOND_PASS_MAX_SECONDS = 30  # Frases más largas no se re-decodifican
+
+# Estado de cada proceso de la segunda pasada (el modelo grande)
+_second_pass_worker = {}
+
+
+def second_pass_init(model_path, stub, niceness):
+    """Inicializa un proceso de la segunda pasada: prioridad baja y modelo"""
+    try:
+        # Solo usar núcleos que el dictado en vivo no necesite
+        os.nice(niceness)
+    except OSError:
+        pass
+    if stub:
+        _second_pass_worker['model'] = None
+    else:
+        from vosk import Model
+        _second_pass_worker['model'] = Model(model_path)
+
+
+def second_pass_decode(number, audio):
+    """Re-decodifica una frase entera -> (número, JSON de Vosk, segundos)"""
+    start = time.perf_counter()
+    model = _second_pass_worker['model']
+    if model is None:
+        recognizer = StubRecognizer(16000)
+    else:
+        from vosk import KaldiRecognizer
+        recognizer = KaldiRecognizer(model, 16000)
+        recognizer.SetWords(True)
+    recognizer.AcceptWaveform(audio)
+    return number, recognizer.FinalResult(), time.perf_counter() - start
+
+
+class SecondPass:
+    """Re-decodifica cada frase terminada con un modelo grande
+
+    El modelo va en procesos aparte con nice: el reconocedor en vivo no
+    espera nunca y el trabajo cae en núcleos libres. on_result(número,
+    JSON, segundos) se llama desde el hilo de resultados del pool. Si se
+    acumulan frases (el modelo grande no da abasto), las nuevas se saltan.
+    """
+
+    def __init__(self, model_path, on_result, workers=1, stub=False, niceness=10):
+        self.on_result = on_result
+        self.max_pending = 4 * workers
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.decoded = 0
+        self.skipped = 0
+        self.seconds = 0.0
+        # spawn: el proceso de la app tiene hilos (y Tk), fork no es seguro
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(workers, initializer=second_pass_init,
+                                 initargs=(model_path, stub, niceness))
+
+    def submit(self, number, audio):
+        """Encola una frase (audio int16 a 16kHz); False si se salta"""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.skipped += 1
+                return False
+            self.pending += 1
+        self.pool.apply_async(second_pass_decode, (number, audio),
+                              callback=self.done, error_callback=self.failed)
+        return True
+
+    def done(self, item):
+        with self.lock:
+            self.pending -= 1
+            self.decoded += 1
+            self.seconds += item[2]
+        try:
+            self.on_result(*item)
+        except Exception as e:
+            print(f"⚠️ Error en la segunda pasada: {e}")
+
+    def failed(self, error):
+        with self.lock:
+            self.pending -= 1
+        print(f"⚠️ Error en la segunda pasada: {error}")
+
+    def close(self):
+        """Al salir no se espera a lo pendiente: ya no se podría corregir"""
+        self.pool.terminate()
+        self.pool.join()
+
+    def stats(self):
+        mean = self.seconds / self.decoded if self.decoded else 0.0
+        return (f"Segunda pasada: {self.decoded} frases ({mean:.2f}s de media), "
+                f"{self.skipped} saltadas")
+
+
+def create_second_pass(config, on_result):
+    """SecondPass según la config (None si no hay modelo grande)"""
+    path = config.get('second_pass_model')
+    if not path:
+        return None
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        print(f"⚠️ Modelo de la segunda pasada no encontrado: {path}")
+        return None
+    workers = config.get('second_pass_workers', 1)
+    print(f"🔁 Segunda pasada con {os.path.basename(path)} ({workers} procesos)")
+    return SecondPass(path, on_result, workers)
+
+
+# === SERVIDOR DE TRANSCRIPCIÓN ===
+# Protocolo: el cliente manda tramas (4 bytes big-endian de longitud +
+# PCM int16 mono a 16kHz). Una trama vacía cierra la frase (FinalResult).
+# Por cada trama el servidor responde una línea JSON: la de Vosk, con
+# "partial" si la frase sigue abierta o "text" si se ha cerrado.
+DEFAULT_SERVER_ADDRESS = "unix:~/.cache/voice_typing.sock"
+
+
+def parse_socket_address(spec):
+    """"unix:RUTA" o "tcp:HOST:PUERTO" -> (familia, dirección)"""
+    if spec.startswith('unix:'):
+        return socket.AF_UNIX, os.path.expanduser(spec[5:])
+    if spec.startswith('tcp:'):
+        host, _, port = spec[4:].rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError(f"Dirección de servidor desconocida: {spec}")
+
+
+def send_frame(sock, data):
+    sock.sendall(len(data).to_bytes(4, 'big') + data)
+
+
+def recv_frame(sock):
+    """Una trama del cliente, o None si ha cerrado la conexión"""
+    header = recv_exact(sock, 4)
+    if len(header) < 4:
+        return None
+    size = int.from_bytes(header, 'big')
+    data = recv_exact(sock, size)
+    return data if len(data) == size else None
+
+
+def compact_json(result_json):
+    """JSON de Vosk (con saltos de línea) -> una sola línea"""
+    return json.dumps(json.loads(result_json), ensure_ascii=False)
+
+
+class RecognizerPool:
+    """Reconocedores del modelo compartido, reutilizados entre conexiones
+
+    Cada conexión tiene el suyo mientras dura; hay como mucho size a la
+    vez (el resto espera turno), así la memoria no crece con los clientes.
+    """
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.Semaphore(size)
+        self.created = 0
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            self.created += 1
+            return self.factory()
+
+    def release(self, recognizer):
+        recognizer.FinalResult()  # Deja el reconocedor limpio para el siguiente
+        self.idle.put(recognizer)
+        self.slots.release()
+
+
+class TranscriptionServer:
+    """Un modelo cargado una vez, un hilo y un reconocedor por cliente
+
+    Vosk suelta el GIL dentro de AcceptWaveform, así que los streams
+    simultáneos se reparten entre núcleos aunque sean hilos.
+    """
+
+    def __init__(self, recognizer_factory, address, max_streams=8):
+        self.pool = RecognizerPool(recognizer_factory, max_streams)
+        self.address = address
+        self.family, self.addr = parse_socket_address(address)
+        self.server = None
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def serve_forever(self):
+        if self.family == socket.AF_UNIX and os.path.exists(self.addr):
+            os.unlink(self.addr)
+        self.server = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.addr)
+        if self.family == socket.AF_UNIX:
+            os.chmod(self.addr, 0o666)  # Todos los usuarios del equipo
+        self.server.listen()
+        print(f"🛰️ Servidor de transcripción en {self.address} "
+              f"(hasta {self.pool.size} streams a la vez)")
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break  # close() desde otro hilo
+            threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+
+    def handle_client(self, conn):
+        """Atiende un stream: trama de audio -> línea JSON de Vosk"""
+        recognizer = self.pool.acquire()
+        with self.lock:
+            self.active += 1
+        print(f"🔗 Cliente conectado ({self.active} activos)")
+        audio = 0
+        cpu = 0.0
+        try:
+            with conn:
+                while True:
+                    frame = recv_frame(conn)
+                    if frame is None:
+                        break
+                    start = time.thread_time()
+                    if not frame:
+                        reply = recognizer.FinalResult()
+                    elif recognizer.AcceptWaveform(frame):
+                        reply = recognizer.Result()
+                    else:
+                        reply = recognizer.PartialResult()
+                    cpu += time.thread_time() - start
+                    audio += len(frame)
+                    conn.sendall(compact_json(reply).encode('utf-8') + b'\n')
+        except OSError as e:
+            print(f"⚠️ Error con el cliente: {e}")
+        finally:
+            self.pool.release(recognizer)
+            with self.lock:
+                self.active -= 1
+            seconds = audio / 2 / 16000
+            print(f"🔌 Cliente desconectado: {seconds:.1f}s de audio, "
+                  f"RTF {cpu / seconds if seconds else 0:.3f} ({self.active} activos)")
+
+    def close(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+        if self.family == socket.AF_UNIX and os.path.exists(self.addr):
+            os.unlink(self.addr)
+
+
+class RemoteRecognizer:
+    """KaldiRecognizer con el mismo API, pero el modelo vive en el servidor
+
+    Si el servidor no contesta en timeout segundos (p. ej. todos sus
+    reconocedores ocupados) se corta la conexión y salta TimeoutError;
+    la siguiente trama vuelve a conectar.
+    """
+
+    def __init__(self, address, timeout=10.0):
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.result = json.dumps({'text': ''})
+        self.partial = json.dumps({'partial': ''})
+        self.connect()
+
+    def connect(self):
+        family, addr = parse_socket_address(self.address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        try:
+            self.sock.connect(addr)
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            raise
+        self.reader = self.sock.makefile('rb')
+
+    def SetWords(self, enabled):
+        pass  # El servidor siempre devuelve las palabras
+
+    def request(self, data):
+        """Manda una trama y espera su respuesta (reconecta si hace falta)"""
+        if self.sock is None:
+            self.connect()
+        try:
+            send_frame(self.sock, data)
+            line = self.reader.readline()
+            if not line:
+                raise ConnectionError("el servidor ha cerrado la conexión")
+        except socket.timeout:
+            self.close()
+            raise TimeoutError(f"el servidor no responde en {self.timeout}s "
+                               "(¿todos los reconocedores ocupados?)") from None
+        except OSError:
+            self.close()
+            raise
+        return line.decode('utf-8')
+
+    def AcceptWaveform(self, data):
+        if not data:
+            return False
+        reply = self.request(data)
+        if 'partial' in json.loads(reply):
+            self.partial = reply
+            return False
+        self.result = reply
+        return True
+
+    def Result(self):
+        return self.result
+
+    def PartialResult(self):
+        return self.partial
+
+    def FinalResult(self):
+        return self.request(b'')
+
+    def close(self):
+        if self.sock:
+            self.reader.close()
+            self.sock.close()
+        self.sock = self.reader = None
+
+
+def run_server(address=DEFAULT_SERVER_ADDRESS, max_streams=8, stub=False,
+               model_path=MODEL_PATH):
+    """Carga el modelo una vez y atiende a todos los clientes"""
+    if stub:
+        factory = lambda: StubRecognizer(16000)
+    else:
+        if not os.path.exists(model_path):
+            print(f"❌ Modelo no encontrado en {model_path}")
+            return
+        from vosk import Model, KaldiRecognizer
+        print(f"🧠 Cargando modelo: {model_path}")
+        model = Model(model_path)
+        
+        def factory():
+            recognizer = KaldiRecognizer(model, 16000)
+            recognizer.SetWords(True)
+            return recognizer
+    
+    server = TranscriptionServer(factory, address, max_streams)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"👋 Servidor cerrado ({server.pool.created} reconocedores creados)")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dictado por voz offline con Vosk")
+    parser.add_argument('--bench-dsp', action='store_true',
+                        help="Compara CPU del pipeline NumPy contra audioop y sale")
+    parser.add_argument('--bench-ring', action='store_true',
+                        help="Compara colas de objetos contra el anillo preasignado de captura y sale")
+    parser.add_argument('--streams', type=int, default=4,
+                        help="Con --bench-ring: flujos de audio simultáneos")
+    parser.add_argument('--bench-conditioning', nargs='*', metavar='AUDIO',
+                        help="Coste del AGC/puerta de ruido y WER antes/después con estos ficheros")
+    parser.add_argument('--search', metavar='TEXTO',
+                        help="Busca en el diario de lo dictado y sale")
+    parser.add_argument('--limit', type=int, default=20,
+                        help="Con --search: número máximo de resultados")
+    parser.add_argument('--list-commands', action='store_true',
+                        help="Lista los comandos de voz registrados y sale")
+    parser.add_argument('--bench-commands', action='store_true',
+                        help="Mide el coste de encontrar comandos y sale")
+    parser.add_argument('--capture-profile', choices=sorted(CAPTURE_PROFILES),
+                        help="Perfil de tamaño de bloque de captura")
+    parser.add_argument('--chunk-ms', type=float,
+                        help="Tamaño de bloque de captura en ms (manda sobre el perfil)")
+    parser.add_argument('--source', metavar='FUENTE',
+                        help="Fuente de audio: pyaudio[:NOMBRE], stdin, file:RUTA, unix:RUTA o multi")
+    parser.add_argument('--source-rate', type=int,
+                        help="Frecuencia del PCM crudo de la fuente (stdin, socket)")
+    parser.add_argument('--replay', nargs='+', metavar='AUDIO',
+                        help="Banco de pruebas offline: WAV/PCM, directorios o globs")
+    parser.add_argument('--serve', nargs='?', const=DEFAULT_SERVER_ADDRESS, metavar='DIRECCIÓN',
+                        help="Servidor de transcripción compartido (unix:RUTA o tcp:HOST:PUERTO)")
+    parser.add_argument('--max-streams', type=int, default=8,
+                        help="Con --serve: streams reconocidos a la vez")
+    parser.add_argument('--server', nargs='?', const=DEFAULT_SERVER_ADDRESS, metavar='DIRECCIÓN',
+                        help="Usar un servidor de transcripción en vez de cargar el modelo")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="Muestra cuánto tarda cada fase del arranque")
+    parser.add_argument('--transcribe', nargs='+', metavar='AUDIO',
+                        help="Transcripción por lotes a JSONL: WAV/PCM, directorios o globs")
+    parser.add_argument('--workers', type=int,
+                        help="Con --transcribe: procesos en paralelo (por defecto, uno por núcleo)")
+    parser.add_argument('--output', metavar='FICHERO',
+                        help="Con --transcribe: fichero JSONL (por defecto, salida estándar)")
+    parser.add_argument('--stub', action='store_true',
+                        help="Con --replay, --transcribe o --serve: reconocedor falso, sin modelo Vosk")
+    parser.add_argument('--realtime', action='store_true',
+                        help="Con --replay: alimentar el audio a velocidad real")
+    parser.add_argument('--raw-rate', type=int, default=16000,
+                        help="Frecuencia de los ficheros PCM crudos")
+    parser.add_argument('--refs', metavar='DIR',
+                        help="Directorio con las transcripciones de referencia (.txt)")
+    parser.add_argument('--replay-json', metavar='FICHERO',
+                        help="Guarda los resultados del banco de pruebas en JSON")
+    args = parser.parse_args()
+    
+    if args.bench_dsp:
+        benchmark_dsp()
+        sys.exit(0)
+    if args.bench_ring:
+        benchmark_capture_buffers(args.streams)
+        sys.exit(0)
+    if args.bench_conditioning is not None:
+        benchmark_conditioning(args.bench_conditioning, stub=args.stub,
+                               raw_rate=args.raw_rate, refs_dir=args.refs)
+        sys.exit(0)
+    if args.search:
+        search_journal(args.search, load_config(), args.limit)
+        sys.exit(0)
+    if args.list_commands:
+        list_commands(load_config())
+        sys.exit(0)
+    if args.bench_commands:
+        benchmark_commands(load_config())
+        sys.exit(0)
+    
+    overrides = {}
+    if args.capture_profile:
+        overrides['capture_profile'] = args.capture_profile
+    if args.chunk_ms:
+        overrides['capture_chunk_ms'] = args.chunk_ms
+    if args.source:
+        overrides['audio_source'] = args.source
+    if args.source_rate:
+        overrides['audio_source_rate'] = args.source_rate
+    if args.server:
+        overrides['recognizer_server'] = args.server
+    
+    if args.serve:
+        run_server(args.serve, max_streams=args.max_streams, stub=args.stub)
+        sys.exit(0)
+    
+    if args.transcribe:
+        run_batch(args.transcribe, workers=args.workers, output=args.output,
+                  stub=args.stub, raw_rate=args.raw_rate)
+        sys.exit(0)
+    
+    if args.replay:
+        run_replay(args.replay, stub=args.stub, realtime=args.realtime,
+                   raw_rate=args.raw_rate, refs_dir=args.refs, json_path=args.replay_json,
+                   overrides=overrides)
+        sys.exit(0)
+    
     print("╔══════════════════════════════════════════════════════════════╗")
     print("║  🎤 BICHÍN VOICE TYPING - VOSK EDITION                       ║")
     print("╠══════════════════════════════════════════════════════════════╣")
@@ -913,5 +4893,5 @@ if __name__ == "__main__":
     print("╚══════════════════════════════════════════════════════════════╝")
     print()
     
-    app = VoiceTyperVosk()
+    app = VoiceTyperVosk(overrides, startup_profile=args.startup_profile)
     app.run()